@@ -0,0 +1,671 @@
+# Benchmarks for the butterflies hot paths
+#
+#   python benchmark.py              - run everything
+#   python benchmark.py plot_wing    - run the named benchmarks only
+#
+# Exits non-zero if a benchmark with a correctness check (lod, plot_wing, replay) fails it
+
+from __future__ import print_function
+
+import os
+import gc
+import sys
+import copy
+import shutil
+import tempfile
+import subprocess
+import math
+import time
+import random
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")  # No window or sound card needed
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+import main
+
+main.SAMPLES_DIR = None  # Don't litter samples/ with benchmark butterflies
+main.TEXTURE_CACHE = None  # Always measure the real work
+
+
+def make_display():
+    display = main.Display(main.World("Benchmark"), (800, 800), (0, 0), headless=True)
+    display.load_fonts()
+    return display
+
+
+def release_world(display):
+    # Let the world's butterflies go, and with them their textures, so they don't count against later benchmarks
+    for e in display.world.get_elements():
+        e.alive = False
+    display.world.tick()
+    display.world.close()
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def drag_script(frames, every=120):
+    # Scripted player: grab whatever is at the bottom middle and drag it up to the target bar
+    script = {}
+    for start in xrange(every, frames, every):
+        script[start] = [pygame.event.Event(pygame.MOUSEBUTTONDOWN, pos=(400, 600), button=1)]
+        for i in xrange(1, 30):
+            script[start + i] = [pygame.event.Event(pygame.MOUSEMOTION, pos=(400 - i * 10, 600 - i * 19), rel=(-10, -19), buttons=(1, 0, 0))]
+        script[start + 30] = [pygame.event.Event(pygame.MOUSEBUTTONUP, pos=(100, 30), button=1)]
+    return script
+
+
+def bench_plot_wing(count=20, seed=1):
+    # Vectorised wing pattern against the original get_at/set_at loop, butterfly for butterfly
+    if main.numpy is None:
+        print("plot_wing: numpy is not installed, only the pixel loop is available")
+        return
+    genomes = [main.Genome.generate(random.Random(seed+i)) for i in xrange(0, count)]
+
+    timings = {}
+    textures = {}
+    for arrays in (False, True):
+        main.WING_PATTERN_ARRAYS = arrays
+        start = time.time()
+        textures[arrays] = [pygame.image.tostring(g.plot_wing(), "RGBA") for g in genomes]
+        timings[arrays] = time.time() - start
+    main.WING_PATTERN_ARRAYS = True
+
+    mismatches = sum(1 for a, b in zip(textures[False], textures[True]) if a != b)
+    print("plot_wing: %d butterflies, radius %d-%d" % (count, min(g.radius for g in genomes), max(g.radius for g in genomes)))
+    print("  pixels %8.2f ms/butterfly" % (timings[False] * 1000.0 / count))
+    print("  arrays %8.2f ms/butterfly  (x%.1f)" % (timings[True] * 1000.0 / count, timings[False] / max(timings[True], 1e-9)))
+    print("  identical textures: %d/%d" % (count - mismatches, count))
+    return mismatches == 0
+
+
+def bench_rotation(count=30, frames=600, seed=1):
+    # Rotated frame atlas against rotating again whenever the cached frame is invalidated
+    atlas = main.ROTATION_ATLAS
+    print("rotation: %d butterflies, %d frames, one selected and one targeted" % (count, frames))
+    for name in ("invalidate", "atlas"):
+        main.ROTATION_ATLAS = atlas if name == "atlas" else None
+        atlas.clear()
+        display = make_display()
+        butterflies = [main.Butterfly(display, "Bench"+str(i), (0, 0, 800, 800), seed+i) for i in xrange(0, count)]
+        butterflies[0].selected = True
+        butterflies[1].targeted = True
+
+        random.seed(seed)
+        start = time.time()
+        for frame in xrange(0, frames):
+            display.world.tick()
+            display.draw()
+            display.flush()
+        elapsed = time.time() - start
+
+        if name == "atlas":
+            memory = atlas.used
+        else:
+            memory = sum(main.surface_bytes(b.img_cache) for b in butterflies if b.img_cache is not None)
+        print("  %-10s %6.2f ms/frame  %7.1f MB of rotated frames" % (name, elapsed * 1000.0 / frames, memory / float(1<<20)))
+        release_world(display)
+    main.ROTATION_ATLAS = atlas
+    print("  atlas hits %d, misses %d" % (atlas.hits, atlas.misses))
+
+
+def populate(display, count, seed):
+    # Cheap butterflies for simulation benchmarks: a few real ones, shallow copied (sharing textures) and scattered
+    rng = random.Random(seed)
+    limits = (0, 0, display.width, display.height)
+    prototypes = [main.Butterfly(display, "Bench", limits, seed+i, spawn=False) for i in xrange(0, 8)]
+    for i in xrange(0, count):
+        b = copy.copy(prototypes[i % len(prototypes)])
+        main.TEXTURES.acquire(b.genome, b.quality) # The copy holds its own reference to the shared textures
+        b.position = (rng.randint(0, display.width), rng.randint(0, display.height))
+        b.facing = rng.randint(0, 359)
+        display.world.add_element(b)
+    for prototype in prototypes:
+        prototype.release() # Never in the world themselves
+    return display.world.get_elements()
+
+
+def bench_swarm(counts=(1000, 10000, 50000), ticks=100, seed=1, shards=(2, 4)):
+    # Per-object Butterfly.update against the numpy Swarm, in this process and sharded over worker processes,
+    # with a statistical comparison of what they did
+    if main.numpy is None:
+        print("swarm: numpy is not installed")
+        return
+    print("swarm: World.tick, %d ticks" % ticks)
+    for count in counts:
+        for mode in ["objects", "swarm"] + ["shards %d" % n for n in shards]:
+            if mode == "objects" and count > 10000:
+                continue # Minutes rather than seconds
+            random.seed(seed)
+            display = make_display()
+            display.world = main.World("Benchmark", swarm=mode == "swarm", shards=int(mode.split()[-1]) if mode.startswith("shards") else 0)
+            butterflies = populate(display, count, seed)
+            start_positions = [b.position for b in butterflies]
+            flutters = turns = 0
+            elapsed = 0.0
+            for tick in xrange(0, ticks):
+                before = [(b.wings_up, b.facing) for b in butterflies]
+                start = time.time()
+                display.world.tick()
+                elapsed += time.time() - start
+                for b, (wings_up, facing) in zip(butterflies, before):
+                    if b.alive:
+                        flutters += b.wings_up != wings_up
+                        turns += b.facing != facing
+            alive = [(b, p) for b, p in zip(butterflies, start_positions) if b.alive]
+            moved = sum(math.hypot(b.position[0]-p[0], b.position[1]-p[1]) for b, p in alive) / max(len(alive), 1)
+            print("  %6d %-8s %8.2f ms/tick  alive %5.1f%%  drift %5.1f px  flutters %.4f  turns %.4f per tick" % (
+                count, mode, elapsed * 1000.0 / ticks, 100.0 * len(alive) / count, moved,
+                flutters / float(count * ticks), turns / float(count * ticks)))
+            release_world(display)
+
+
+def bench_frames(counts=(10, 30, 100, 300), frames=600, seed=1):
+    # Whole frames of a headless game, with a scripted player, timed phase by phase by the game's own profiler
+    print("frames: headless game, %d frames, p50/p99 ms per phase" % frames)
+    profiler = main.PROFILER
+    profiler.history = frames
+    for count in counts:
+        display = make_display()
+        game = main.Game(display, seed, workers=0, population=count, max_items=count, script=drag_script(frames))
+        game.step() # Spawns the whole population
+        profiler.enabled = True
+        profiler.reset()
+        for frame in xrange(0, frames):
+            game.step()
+        profiler.enabled = False
+        phases = ["events"] + [name for name, phase in game.simulation_phases + game.render_phases if name != "targets"] + ["targets"]
+        totals = [sum(phase) for phase in zip(*[profiler.series[name] for name in phases])]
+        print("  %4d butterflies  frame %6.2f/%6.2f  " % (count, percentile(totals, 0.5), percentile(totals, 0.99)) +
+              "  ".join("%s %.2f/%.2f" % (name, profiler.percentile(name, 0.5), profiler.percentile(name, 0.99))
+                        for name in phases))
+        print("  %18s " % "" + "  ".join("%s %d" % (name, sum(profiler.series[name])) for name in sorted(profiler.counters)))
+        release_world(display)
+
+
+def bench_dirty(count=30, frames=300, seed=1):
+    # Full redraw against the dirty rect renderer, with the butterflies moving and with them standing still
+    print("dirty: %d butterflies, %d frames, render ms/frame (p50/p99) and share of the screen updated" % (count, frames))
+    profiler = main.PROFILER
+    profiler.history = frames
+    for moving in (True, False):
+        for dirty in (False, True):
+            display = make_display()
+            display.set_dirty_rects(dirty)
+            game = main.Game(display, seed, workers=0, population=count, max_items=count)
+            game.step()
+            profiler.enabled = True
+            profiler.reset()
+            for frame in xrange(0, frames):
+                if moving:
+                    game.simulate()
+                profiler.start("render")
+                game.render(1.0)
+                profiler.stop("render")
+                profiler.end_frame()
+            profiler.enabled = False
+            updated = 1.0
+            if dirty:
+                updated = sum(profiler.series["dirty pixels"]) / float(frames * display.width * display.height)
+            print("  %-7s %-6s %6.2f/%6.2f ms  %5.1f%% of the screen" % ("moving" if moving else "still", "dirty" if dirty else "full",
+                  profiler.percentile("render", 0.5), profiler.percentile("render", 0.99), updated * 100.0))
+            release_world(display)
+
+
+def bench_text(frames=600, every=10):
+    # HUD score and fade text rendered straight from the font every frame, as they used to be, against the text cache
+    print("text: %d frames, score changing every %d frames, one fading line" % (frames, every))
+    display = make_display()
+    font = display.labelfontbig
+    profiler = main.PROFILER
+    profiler.history = frames
+    for name in ("font", "cached"):
+        display.text = main.TextRenderer(4<<20)
+        profiler.enabled = True
+        profiler.reset()
+        start = time.time()
+        for frame in xrange(0, frames):
+            score = frame // every * 70
+            counter = 255 - frame % 255
+            if name == "font":
+                imgs = [font.render(str(score), 1, (255, 255, 255, 255)), font.render(str(score), 1, (0, 0, 0, 128)),
+                        font.render("LEVEL 1", 1, (counter, counter, counter, 255))]
+                profiler.count("font renders", len(imgs))
+            else:
+                imgs = [display.render_number(font, score, 1, (255, 255, 255, 255)), display.render_number(font, score, 1, (0, 0, 0, 128)),
+                        display.text.render_faded(font, "LEVEL 1", 1, (255, 255, 255, 255), counter)]
+            for img in imgs:
+                display.blit(img, (0, 0))
+            profiler.end_frame()
+        elapsed = time.time() - start
+        profiler.enabled = False
+        print("  %-7s %6.3f ms/frame  %5d font renders  %8.1f font renders/s" % (
+            name, elapsed * 1000.0 / frames, sum(profiler.series["font renders"]), profiler.rate("font renders")))
+
+
+def bench_particles(counts=(30, 1000, 5000), frames=300, seed=1):
+    # The old list of tuples rebuilt each frame and drawn a circle at a time, against the array pool and its sprites
+    print("particles: %d frames, bursts topping the system up to each count, ms/frame update + draw" % frames)
+    display = make_display()
+    width, height = display.width, display.height
+    sprites = [main.circle_sprite(radius, (255, 255, 255, 255)) for radius in xrange(2, 6)]
+    for count in counts:
+        timings = {}
+        for name in ("tuples", "pool"):
+            rng = random.Random(seed)
+            particles = [] if name == "tuples" else main.ParticlePool(max(count, 1))
+            start = time.time()
+            for frame in xrange(0, frames):
+                live = len(particles) if name == "tuples" else particles.count
+                for i in xrange(live, count): # Burst from the middle of the screen
+                    dx, dy = 0.3 - rng.random() * 0.6, 0.1 - rng.random() * 0.2
+                    if name == "tuples":
+                        particles.append(((width >> 1, height >> 1), dx, dy))
+                    else:
+                        sprite = sprites[i % len(sprites)]
+                        particles.emit((width >> 1, height >> 1), dx, dy, sprite, (sprite.get_width() >> 1,) * 2)
+                if name == "tuples":
+                    moved = []
+                    for (x, y), dx, dy in particles:
+                        x += dx
+                        y += dy
+                        dy += 0.01
+                        if 0 <= x < width and 0 <= y < height:
+                            moved.append(((x, y), dx, dy))
+                    particles = moved
+                    for (x, y), dx, dy in particles:
+                        pygame.draw.circle(display.surface, (255, 255, 255, 255), (int(x), int(y)), display.rng.randint(2, 5), 0)
+                else:
+                    particles.update(width, height)
+                    display.blits(particles.blit_list())
+            timings[name] = (time.time() - start) * 1000.0 / frames
+        print("  %5d particles  tuples %7.3f  pool %7.3f  (x%.1f)" % (count, timings["tuples"], timings["pool"], timings["tuples"] / max(timings["pool"], 1e-9)))
+
+
+def resident_bytes():
+    # Resident set size, from /proc where there is one
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 # Peak rather than current, but only ever grows here
+
+
+def memory_per_butterfly(count, seed=1):
+    # Growth in resident memory from adding count real butterflies (and their spatial index entries) to a world
+    display = make_display()
+    limits = (0, 0, display.width, display.height)
+    genomes = [main.Genome.generate(random.Random(seed+i)) for i in xrange(0, 8)]
+    for genome in genomes:
+        main.TEXTURES.acquire(genome) # Drawn once up front, then shared by every butterfly of the genome
+    gc.collect()
+    before = resident_bytes()
+    butterflies = [main.Butterfly(display, "Bench", limits, seed+i, genome=genomes[i % len(genomes)]) for i in xrange(0, count)]
+    gc.collect()
+    return (resident_bytes() - before) / float(len(butterflies))
+
+
+def bench_memory(counts=(1000, 10000, 100000), seed=1):
+    # Each count in a fresh interpreter, so memory freed by an earlier one can't be reused and hide the growth
+    print("memory: resident bytes per butterfly, textures shared between butterflies of the same genome")
+    for count in counts:
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__), "--memory", str(count), str(seed)])
+        print("  %6d butterflies  %7.0f bytes each" % (count, float(output.split()[-1])))
+
+
+def bench_textures(population=200, ticks=600, churn=2, seed=1):
+    # Butterflies leaving and joining a world every tick, either as respawns of a few known genomes or all new ones.
+    # Texture memory held should follow the genomes in play, not the butterflies ever built
+    print("textures: %d butterflies, %d leave and join each tick, texture MB held (interned / one set per butterfly)" % (population, churn))
+    for name, genome_pool in (("respawn", 20), ("new", None)):
+        rng = random.Random(seed)
+        display = make_display()
+        limits = (0, 0, display.width, display.height)
+        genomes = [main.Genome.generate(random.Random(seed+i)) for i in xrange(0, genome_pool or 0)]
+        spawned = [0]
+        used_before, genomes_before = main.TEXTURES.used(), len(main.TEXTURES.genomes) # Anything still held from before
+
+        def spawn():
+            spawned[0] += 1
+            if genome_pool is None:
+                return main.Butterfly(display, "Bench", limits, seed + spawned[0])
+            return main.Butterfly(display, "Bench", limits, seed + spawned[0], genome=rng.choice(genomes))
+
+        for i in xrange(0, population):
+            spawn()
+        samples = []
+        start = time.time()
+        for tick in xrange(0, ticks + 1):
+            if tick % (ticks // 4) == 0:
+                live = display.world.get_elements()
+                unshared = sum(sum(main.surface_bytes(img) for img in (b.texture, b.texture_body, b.icon)) for b in live)
+                samples.append("%d: %.1f/%.1f" % (tick, (main.TEXTURES.used() - used_before) / float(1<<20), unshared / float(1<<20)))
+            for b in rng.sample(display.world.get_elements(), churn):
+                b.alive = False
+            display.world.tick()
+            for i in xrange(0, churn):
+                spawn()
+        elapsed = time.time() - start
+        print("  %-8s %6.2f ms/tick  %4d genomes held  %s" % (name, elapsed * 1000.0 / ticks, len(main.TEXTURES.genomes) - genomes_before, "  ".join(samples)))
+        release_world(display)
+
+
+# How far each quality level's wings may be from full resolution before bench_lod fails: mean difference per
+# channel (0-255) and the share of pixels off by more than 64
+LOD_LIMITS = {"full": (0.0, 0.0), "lod": (12.0, 0.10), "low": (12.0, 0.15)}
+
+
+def bench_lod(count=30, seed=1):
+    # Wing textures at each quality level: how long they take to build and how far they are from full resolution.
+    # Fails if any level is further off than LOD_LIMITS allows
+    if main.numpy is None:
+        print("lod: numpy is not installed, needed for the visual diff")
+        return
+    genomes = [main.Genome.generate(random.Random(seed+i)) for i in xrange(0, count)]
+    print("lod: %d butterflies, radius %d-%d. Diff against full: mean per channel (0-255), %% of pixels off by more than 64" % (
+        count, min(g.radius for g in genomes), max(g.radius for g in genomes)))
+    quality = main.TEXTURE_QUALITY
+    full = None
+    passed = True
+    for arrays in (True, False):
+        main.WING_PATTERN_ARRAYS = arrays
+        for name in main.QUALITY_LEVELS:
+            main.TEXTURE_QUALITY = name
+            start = time.time()
+            textures = [g.render()[0] for g in genomes]
+            elapsed = time.time() - start
+            pixels = [pygame.surfarray.pixels3d(t).astype(main.numpy.int64) for t in textures]
+            alphas = [pygame.surfarray.array_alpha(t).astype(main.numpy.int64) for t in textures]
+            if full is None:
+                full = [main.numpy.dstack((p, a)) for p, a in zip(pixels, alphas)]
+            diffs = [main.numpy.abs(main.numpy.dstack((p, a)) - f) for p, a, f in zip(pixels, alphas, full)]
+            del pixels, alphas
+            mean = sum(d.mean() for d in diffs) / len(diffs)
+            off = sum((d.max(axis=2) > 64).mean() for d in diffs) / len(diffs)
+            max_mean, max_off = LOD_LIMITS[name]
+            ok = bool(mean <= max_mean and off <= max_off)
+            passed = passed and ok
+            print("  %-6s %-5s %7.2f ms/butterfly  diff %5.2f  %5.2f%% of pixels  %s" % (
+                "arrays" if arrays else "pixels", name, elapsed * 1000.0 / count, mean, off * 100.0, "ok" if ok else "FAIL"))
+    main.WING_PATTERN_ARRAYS = True
+    main.TEXTURE_QUALITY = quality
+    return passed
+
+
+def bench_targets(population=2000, counts=(10, 100, 1000), ticks=200, seed=1):
+    # Every target tested against its slot every tick, as the game used to, against the TargetTracker which only
+    # tests the targets that moved. The population drifts as usual, so most of the world moves every tick
+    print("targets: %d butterflies, %d ticks, ms/tick for target matching (slots laid out off the top of the screen)" % (population, ticks))
+    for count in counts:
+        timings = {}
+        for name in ("every", "tracker"):
+            random.seed(seed)
+            display = make_display()
+            butterflies = populate(display, population, seed)
+            tracker = main.TargetTracker(display.world, top=-10000) # Out of reach, so nothing matches and the targets stay
+            targets = butterflies[:count]
+            for t in targets:
+                tracker.add(t)
+            elapsed = 0.0
+            for tick in xrange(0, ticks):
+                display.world.tick()
+                start = time.time()
+                if name == "every":
+                    cursor_x = 2
+                    for s in targets:
+                        if s.icon is not None and s.alive:
+                            display.world.query_rect((cursor_x, -10000, s.icon.get_width(), s.icon.get_height()))
+                            cursor_x += 2 + s.icon.get_width()
+                else:
+                    tracker.update()
+                elapsed += time.time() - start
+            timings[name] = elapsed * 1000.0 / ticks
+            release_world(display)
+        print("  %5d targets  every %7.3f  tracker %7.3f" % (count, timings["every"], timings["tracker"]))
+
+
+def bench_replay(ticks=3000, seed=5):
+    # Record a scripted session, play it back without drawing, and check it ends up exactly where it did
+    def fingerprint(game):
+        butterflies = sorted((e.name, e.position, e.facing) for e in game.display.world.get_elements())
+        return game.player.score, butterflies, [t.name for t in game.targets], random.getstate()
+
+    display = make_display()
+    replay = main.Replay(seed)
+    game = main.Game(display, seed, workers=0, script=drag_script(ticks, 45), replay=replay)
+    start = time.time()
+    while game.iterationCount < ticks:
+        game.step()
+    recorded = time.time() - start
+    replay.ticks = game.iterationCount
+    expected = fingerprint(game)
+    release_world(display)
+
+    handle, filename = tempfile.mkstemp(suffix=".replay")
+    os.close(handle)
+    try:
+        replay.save(filename)
+        size = os.path.getsize(filename)
+        start = time.time()
+        game = main.play_replay(filename)
+        played = time.time() - start
+    finally:
+        os.remove(filename)
+    print("replay: %d ticks, %d events in %d bytes, score %d" % (ticks, sum(len(e) for e in replay.events.values()), size, expected[0]))
+    print("  recorded %6.0f ticks/s  replayed %6.0f ticks/s  (x%.1f)  identical end state: %s" % (
+        ticks / recorded, ticks / played, recorded / max(played, 1e-9), fingerprint(game) == expected))
+    identical = fingerprint(game) == expected
+    release_world(game.display)
+    return identical
+
+
+def time_to_first_frame(workers=2):
+    # Seconds from creating the window to the first frame on it, and until everything startup loads is in
+    start = time.time()
+    display = main.Display(main.World("Butterflies"), (800, 800), (0, 0))
+    game = main.Game(display, 1, workers)
+    game.run_frame()
+    first = time.time() - start
+    while game.loaded is None:
+        game.run_frame()
+    return first, time.time() - start, game.initial_population
+
+
+def bench_startup(runs=3):
+    # Each run in a fresh interpreter with the real window path (dummy drivers), music and logo included
+    print("startup: seconds to the first frame and until fonts, logo, music and the initial population are in, cold texture cache, best of %d" % runs)
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for run in xrange(0, runs):
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__), "--startup"], cwd=here)
+        results.append([float(v) for v in output.split()[-3:]])
+    first, full, population = min(results)
+    print("  first frame %6.3f s  everything, with %d butterflies, %6.3f s" % (first, population, full))
+
+
+def bench_scale(runs=5):
+    # The logo's shrink animation, a frame a tick: a new transform.scale surface each time, against ScaledSurfaces
+    # with no keyframes (everything through the reused buffer) and with keyframes precomputed under its budget
+    logo = pygame.image.load(os.path.join(os.path.dirname(os.path.abspath(__file__)), "WF4_t_w.png"))
+    sizes = [(logo.get_width()-shrink, logo.get_height()-shrink) for shrink in xrange(logo.get_width()>>1)]
+    print("scale: logo shrink animation, %d frames from %dx%d, best of %d" % (len(sizes), logo.get_width(), logo.get_height(), runs))
+    for name in ("transform", "buffer", "keyframes"):
+        best = None
+        for run in xrange(0, runs):
+            scaled = main.ScaledSurfaces(8<<20)
+            start = time.time()
+            if name == "keyframes":
+                scaled.precompute(logo, sizes)
+            loaded = time.time()
+            allocated = 0
+            for size in sizes:
+                if name == "transform":
+                    img = pygame.transform.scale(logo, size)
+                    allocated += main.surface_bytes(img)
+                else:
+                    img = scaled.scale(logo, size)
+            elapsed = time.time() - loaded
+            if name != "transform":
+                allocated = sum(main.surface_bytes(b) for b in scaled.buffers.values())
+            if best is None or elapsed < best[0]:
+                best = (elapsed, loaded - start, allocated, scaled.used)
+        elapsed, precompute, allocated, kept = best
+        print("  %-9s %6.3f ms/frame  precompute %6.1f ms  %6.2f MB allocated while animating, %5.2f MB kept" % (
+            name, elapsed * 1000.0 / len(sizes), precompute * 1000.0, allocated / float(1<<20), kept / float(1<<20)))
+
+
+def bench_queue(counts=(100, 1000, 3000), frames=50, seed=1):
+    # The world drawn as it used to be, a bounds check and a blit per butterfly, against submitting them all
+    # to the render queue and flushing it with one Surface.blits per layer
+    print("queue: drawing the world, %d frames, ms/frame" % frames)
+    for count in counts:
+        timings = {}
+        for name in ("each", "queue"):
+            random.seed(seed)
+            display = make_display()
+            populate(display, count, seed)
+            viewport = (0, 0, display.width, display.height)
+            start = time.time()
+            for frame in xrange(0, frames):
+                if name == "each":
+                    display.surface.fill(display.world.colour_background)
+                    for e in display.world.query_rect(viewport):
+                        if e.physics.check_collides(viewport, e.get_rect()):
+                            display.blit(*e.sprite(display))
+                else:
+                    display.draw()
+                    display.flush()
+            timings[name] = (time.time() - start) * 1000.0 / frames
+            release_world(display)
+        print("  %5d butterflies  each %7.2f  queue %7.2f  (%.2fx)" % (count, timings["each"], timings["queue"], timings["each"] / timings["queue"]))
+
+
+def bench_ornaments(count=60, runs=9, seed=1):
+    # Ornaments.paint on its own, over wings already plotted without ornaments, against plotting those wings
+    genomes = [main.Genome.generate(random.Random(seed+i)) for i in xrange(0, count)]
+    wings = []
+    for g in genomes:
+        ornaments, g.ornaments = g.ornaments, ()
+        wings.append(g.plot_wing())
+        g.ornaments = ornaments
+    print("ornaments: %d butterflies, radius %d-%d, %d ornaments, best of %d" % (
+        count, min(g.radius for g in genomes), max(g.radius for g in genomes), sum(len(g.ornaments) for g in genomes), runs))
+    timings = {"wing": [], "ornaments": []}
+    for run in xrange(0, runs):
+        copies = [wing.copy() for wing in wings]
+        start = time.time()
+        for g, wing in zip(genomes, copies):
+            main.Ornaments.paint(wing, g.ornaments, g.colours)
+        timings["ornaments"].append(time.time() - start)
+        start = time.time()
+        for g in genomes:
+            g.plot_wing()
+        timings["wing"].append(time.time() - start)
+    for name in ("wing", "ornaments"):
+        print("  %-9s %6.3f ms/butterfly" % (name, min(timings[name]) * 1000.0 / count))
+
+
+def bench_formats(blits=2000, seed=1):
+    # Blits to the display of typical surfaces as drawn, and converted each way display_format can. The auto column
+    # is what display_format picks; colorkey loses the soft edges of surfaces that have them, opaque loses transparency
+    display = make_display()
+    butterfly = main.Butterfly(display, "Bench", (0, 0, 800, 800), seed, spawn=False)
+    genome = butterfly.genome
+    texture, body, icon = genome.render()
+    frame = pygame.Surface(texture.get_size(), pygame.SRCALPHA)
+    frame.blit(body, (0, 0))
+    frame.blit(texture, (0, 0))
+    particle = pygame.Surface((8, 8), pygame.SRCALPHA)
+    pygame.draw.circle(particle, (0, 0, 0, 255), (4, 4), 4, 0)
+    samples = [
+        ("butterfly", pygame.transform.rotate(frame, 30)),
+        ("icon", icon),
+        ("text", display.labelfontbig.render("LEVEL 12", 1, (255, 255, 255, 255))),
+        ("particle", particle),
+        ("logo", pygame.image.load(os.path.join(os.path.dirname(os.path.abspath(__file__)), "WF4_t_w.png"))),
+    ]
+    print("formats: us per blit to the display, %d blits each" % blits)
+    print("  %-10s %9s  %7s %7s %7s %7s  %s" % ("", "size", "as is", "alpha", "key+rle", "opaque", "auto"))
+    for name, img in samples:
+        timings = []
+        for kind in (None, "alpha", "colorkey", "opaque"):
+            converted = img if kind is None else main.display_format(img, kind)
+            start = time.time()
+            for i in xrange(0, blits):
+                display.surface.blit(converted, ((i * 37) % 600, (i * 53) % 600))
+            timings.append((time.time() - start) * 1e6 / blits)
+        print("  %-10s %4dx%-4d  %7.1f %7.1f %7.1f %7.1f  %s" % ((name,) + img.get_size() + tuple(timings) + (main.surface_kind(img),)))
+    butterfly.release()
+
+
+def bench_governor(count=300, seconds=40, seed=1):
+    # A windowed session with more butterflies than the machine keeps up with, with the governor off and on:
+    # how long frames take at the start and the end, and the tiers it went through on the way
+    print("governor: %d butterflies, %ds of windowed frames, p50/p90 ms of work per frame" % (count, seconds))
+    for govern in (False, True):
+        display = make_display()
+        game = main.Game(display, seed, workers=0, population=count, max_items=count, govern=govern)
+        game.step() # Spawns the whole population
+        frames = []
+        tiers = [(0.0, game.governor.level)]
+        start = time.time()
+        while time.time() - start < seconds:
+            game.run_frame()
+            frames.append(game.clock.get_rawtime())
+            if game.governor.level != tiers[-1][1]:
+                tiers.append((time.time() - start, game.governor.level))
+        first, last = frames[:len(frames)//4], frames[-(len(frames)//4):]
+        print("  %-3s  first quarter %6.2f/%6.2f  last quarter %6.2f/%6.2f  %4d frames  %3d butterflies  tiers %s" % (
+              "on" if govern else "off", percentile(first, 0.5), percentile(first, 0.9), percentile(last, 0.5), percentile(last, 0.9),
+              len(frames), len(display.world.get_elements()), " ".join("%d@%.0fs" % (level, at) for at, level in tiers)))
+        game.governor.restore()
+        release_world(display)
+
+
+BENCHMARKS = [
+    ("plot_wing", bench_plot_wing),
+    ("rotation", bench_rotation),
+    ("swarm", bench_swarm),
+    ("frames", bench_frames),
+    ("dirty", bench_dirty),
+    ("text", bench_text),
+    ("particles", bench_particles),
+    ("memory", bench_memory),
+    ("textures", bench_textures),
+    ("lod", bench_lod),
+    ("targets", bench_targets),
+    ("replay", bench_replay),
+    ("startup", bench_startup),
+    ("scale", bench_scale),
+    ("queue", bench_queue),
+    ("ornaments", bench_ornaments),
+    ("formats", bench_formats),
+    ("governor", bench_governor),
+]
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ["--memory"]:
+        print(memory_per_butterfly(int(sys.argv[2]), int(sys.argv[3])))
+        sys.exit(0)
+    if sys.argv[1:2] == ["--startup"]:
+        cache = tempfile.mkdtemp() # A first run: nothing on disk yet
+        main.TEXTURE_CACHE = main.TextureCache(cache)
+        try:
+            print("%f %f %d" % time_to_first_frame())
+        finally:
+            shutil.rmtree(cache)
+        sys.exit(0)
+    wanted = sys.argv[1:]
+    failed = []
+    for name, bench in BENCHMARKS:
+        if not wanted or name in wanted:
+            if bench() is False: # The ones with a check return whether it passed
+                failed.append(name)
+    if failed:
+        print("FAILED: " + ", ".join(failed))
+        sys.exit(1)
@@ -0,0 +1,121 @@
+# Butterfly texture libraries, generated offline on every core
+#
+#   python generate.py --seeds 0 10000 --out library
+#
+# Writes library/sheet_0000.png, sheet_0001.png... with the butterflies packed in a grid of cells, as the game
+# would draw them for the given seeds, and library/index.json with each one's seed, genome and place on its sheet.
+# Sheets are saved as they fill and the index is written as it goes, so only one sheet is ever held in memory.
+# --cache also saves each butterfly's textures where the game looks for them. Run the game with the same range,
+#   python main.py --seeds 0 10000 --texture-cache cache/textures --texture-cache-mb 0
+# and it loads those textures rather than drawing them (0: no size limit, so none of them are evicted)
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import multiprocessing
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")  # No window or sound card needed
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+import main
+
+CELL = 256  # Big enough for the largest butterfly, radius 128
+
+
+def start_worker(quality, cache):
+    main.TEXTURE_QUALITY = quality
+    main.SAMPLES_DIR = None
+    main.TEXTURE_CACHE = None
+    if cache is not None:
+        main.TEXTURE_CACHE = main.TextureCache(cache, None) # Never evict what we are here to make
+
+
+def build(seed):
+    # In a worker: the butterfly for this seed, as an RGBA string, since surfaces can't be sent between processes
+    genome = main.Genome.generate(random.Random(seed))
+    if main.TEXTURE_CACHE is not None:
+        texture, texture_body, icon = main.TEXTURE_CACHE.fetch(genome)
+    else:
+        texture, texture_body, icon = genome.render()
+    sample = pygame.transform.rotate(genome.plot_sample(texture, texture_body), 90)
+    return seed, genome.to_dict(), sample.get_size(), pygame.image.tostring(sample, "RGBA")
+
+
+class SheetWriter:
+    # Packs images into sheets of columns x rows cells, left to right and top to bottom, saving each one once it is full
+    def __init__(self, folder, columns, rows, cell=CELL):
+        self.folder = folder
+        self.columns = columns
+        self.rows = rows
+        self.cell = cell
+        self.sheets = 0
+        self.sheet = None
+        self.filename = None
+        self.cells = 0 # Used on the current sheet
+
+    def add(self, size, pixels):
+        # Returns the sheet's filename and where on it the image went
+        if self.sheet is None:
+            self.sheet = pygame.Surface((self.columns*self.cell, self.rows*self.cell), pygame.SRCALPHA)
+            self.filename = "sheet_%04d.png" % self.sheets
+            self.sheets += 1
+        x = (self.cells % self.columns) * self.cell
+        y = (self.cells // self.columns) * self.cell
+        self.sheet.blit(pygame.image.fromstring(pixels, size, "RGBA"), (x, y))
+        filename = self.filename
+        self.cells += 1
+        if self.cells == self.columns * self.rows:
+            self.close()
+        return filename, x, y
+
+    def close(self):
+        if self.sheet is not None:
+            pygame.image.save(self.sheet, os.path.join(self.folder, self.filename))
+            self.sheet = None
+            self.cells = 0
+
+
+def generate(first, last, folder, workers=None, columns=8, rows=8, quality="full", cache=None):
+    # Butterflies for seeds first to last (not included), built by a pool of worker processes and taken in seed order
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    sheets = SheetWriter(folder, columns, rows)
+    pool = multiprocessing.Pool(workers, start_worker, (quality, cache))
+    count = 0
+    try:
+        with open(os.path.join(folder, "index.json"), "w") as index:
+            index.write('{"cell": %d, "quality": %s, "butterflies": [\n' % (CELL, json.dumps(quality)))
+            for seed, genome, size, pixels in pool.imap(build, xrange(first, last), chunksize=8):
+                sheet, x, y = sheets.add(size, pixels)
+                entry = {"seed": seed, "sheet": sheet, "rect": [x, y, size[0], size[1]], "genome": genome}
+                if count > 0:
+                    index.write(",\n")
+                index.write(json.dumps(entry, sort_keys=True))
+                count += 1
+            index.write("\n]}\n")
+        sheets.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    return count, sheets.sheets
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate butterflies into sprite sheets, with a JSON index")
+    parser.add_argument("--seeds", type=int, nargs=2, metavar=("FIRST", "LAST"), required=True, help="seeds FIRST up to LAST")
+    parser.add_argument("--out", default="library", help="folder for the sheets and index.json")
+    parser.add_argument("--workers", type=int, help="processes to use, every core by default")
+    parser.add_argument("--sheet", type=int, nargs=2, default=(8, 8), metavar=("COLUMNS", "ROWS"), help="cells per sheet")
+    parser.add_argument("--quality", choices=list(main.QUALITY_LEVELS), default=main.TEXTURE_QUALITY, help="butterfly texture detail")
+    parser.add_argument("--cache", metavar="FOLDER", help="also save the textures here for main.py --seeds --texture-cache, e.g. cache/textures")
+    args = parser.parse_args()
+    start = time.time()
+    count, sheets = generate(args.seeds[0], args.seeds[1], args.out, args.workers, args.sheet[0], args.sheet[1], args.quality, args.cache)
+    elapsed = time.time() - start
+    print("%d butterflies on %d sheets in %.1fs (%.1f/s)" % (count, sheets, elapsed, count / max(elapsed, 1e-9)))
@@ -1,818 +1,3016 @@
-# @TheWorldFoundry
-# 2020-09-27
-#   - Interaction UI simplified - now: click, drag, release
-#   - Disabled 'jitter' when a butterfly is selected, allowing easier shape and pattern compare for player
-#   - Scoring change to "x level" instead of doubling player score on row clear
-#   - Remove reference to right-click release as game is now one-touch for all button types
-
-
-import pygame
-import random
-import math
-import os
-
-
-class Colour:
-    def __init__(self):
-        self.colours = {
-            "black": (0x05, 0x03, 0x09, 0xff),
-            "white": (0xff, 0xff, 0xff, 0xff),
-            "green": (0x00, 0xa0, 0x00, 0xff),
-            "red": (0xa0, 0x00, 0x00, 0xff),
-            "brown": (0x70, 0x60, 0x70, 0xff),
-            "transparent": (0x00, 0x00, 0x00, 0xff),
-            "world_background": (0x80, 0x70, 0x90, 0xff)
-        }
-
-    def get(self, key):
-        if key not in self.colours:
-            # Issue a new random colour if we didn't find the requested one
-            self.colours[key] = (128+random.randint(0, 127), 128+random.randint(0, 127), 128+random.randint(0, 127), 255)
-        return self.colours[key]
-
-class Physics:
-    def __init__(self):
-        pass
-
-    def check_collides(self, rect_a, rect_b):
-        ox_a, oy_a, w_a, h_a = rect_a
-        ox_b, oy_b, w_b, h_b = rect_b
-
-        # Assume we have collided, then prove if we haven't
-        if ox_a + w_a -1 <= ox_b:
-            return False
-        elif ox_a >= ox_b + w_b:
-            return False
-        elif oy_a + h_a <= oy_b:
-            return False
-        elif oy_a >= oy_b + h_b:
-            return False
-        return True # Has collided
-
-class World:
-    def __init__(self, description):
-        self.description = description
-        self.elements = []
-        self.colour_background = Colour().get("world_background")
-        self.regions = []
-
-    def get_description(self):
-        return self.description
-
-    def add_element(self, element):
-        self.elements.append(element)
-
-    def get_elements(self):
-        return self.elements
-
-    def tick(self):
-        newElements = []
-        for e in self.elements:
-            if e.alive:
-                e.update()
-                newElements.append(e)
-        self.elements = newElements
-
-class Thing(object):
-    def __init__(self, world, position, radius, name):
-        self.alive = True
-        self.world = world
-        self.name = name
-        self.position = position  # Co-ordinates within the world
-        self.velocity = [0.0, 0.0]  # 2Direction (Radians), speed
-        self.characteristics = {}
-        self.animation = None
-        self.age = 0
-        self.size = radius
-        self.physics = Physics()
-
-        self.selected = False
-        self.targeted = False
-
-    def getColourPrimary(self):
-        key = "ColourPrimary"
-        if key not in self.characteristics:
-            newColour = Colour().get("random")
-            self.characteristics[key] = newColour
-        return self.characteristics[key]
-
-    def get_rect(self):
-        # Coordinates for the bounding box in the world
-        ox, oy = self.position
-        return (ox-self.size, oy-self.size, (self.size<<1), (self.size<<1))
-
-    def handle_event_click(self, pos):
-        click_x, click_y = pos
-
-        ox, oy, w, h = self.get_rect()
-
-        if ox <= click_x < ox+w and oy <= click_y < oy+h:
-            return True # Within bounds
-
-    def update(self):
-        self.age += 1
-
-    def draw(self, display):
-        # Work out my position in the world, and how it maps onto the display
-        ox, oy = display.position
-
-        # Only draw this Thing if the Thing is within the display
-        bounds = self.get_rect()
-        #print bounds
-        # print "draw",bounds
-        if self.physics.check_collides((ox, oy, display.width, display.height), bounds):
-            # print "Drawing",self.name
-            minx, miny, w, h = bounds
-            pygame.draw.rect(display.surface, self.getColourPrimary(), (minx, miny, w, h))
-
-    def draw_highlight(self, display, colour):
-        ox, oy = display.position
-
-        # Only draw this Thing if the Thing is within the display
-        bounds = self.get_rect()
-        #print "draw",bounds
-        if self.physics.check_collides((ox, oy, display.width, display.height), bounds):
-            #print "Drawing",self.name
-            minx, miny, w, h = bounds
-            pygame.draw.rect(display.surface, colour, (minx, miny, w, h), 2)
-
-class Butterfly(Thing):
-    def __init__(self, display, name, position_limits):
-        icon_size = 64
-        position = random.randint(0, display.surface.get_width()),random.randint(display.surface.get_height()>>1, display.surface.get_height())
-        radius = random.randint(icon_size>>1,128)
-        super(Butterfly,self).__init__(display.world, position, radius, name)
-        self.position_limits = position_limits
-
-        display.world.add_element(self)
-
-        # Animation hints
-        self.facing = random.randint(0,359) # Initialise facing a random direction - Degrees
-        # Geometry
-        self.main_wing = []
-        self.sub_wing = []
-        self.body = []
-        self.antennae = []
-        self.main_wing, self.sub_wing, self.body, self.antennae = self.create_geometry()
-        jitter = 0.1
-        self.main_wing = self.jitter(self.main_wing, jitter)
-        self.sub_wing = self.jitter(self.sub_wing, jitter)
-
-        c = Colour()
-        self.colours = []
-        for i in xrange(0,random.randint(3,21)):
-            if random.randint(1,10) == 1:
-                keys = c.colours.keys()
-                self.colours.append(c.get(keys[random.randint(0,len(keys)-1)]))
-            else:
-                self.colours.append(c.get("random"+str(i)))
-
-        self.pattern_scaler = 0.00001 + random.random() * 0.01
-        self.texture = self.plot_wing()
-        self.texture_body = self.plot_body()
-
-        if os.path.exists("samples"):
-            sample = pygame.Surface((self.texture.get_width(),self.texture.get_height()),pygame.SRCALPHA)
-            sample.blit(self.texture_body,(0,0))
-            sample.blit(self.texture, (0, 0))
-
-            pygame.image.save(pygame.transform.rotate(sample,90), "samples/butterfly_"+self.name+str(random.randint(1000000000,9999999999))+".png")
-
-
-        self.wings_up = False
-        self.img_render_buffer = pygame.Surface((self.texture.get_width(), self.texture.get_height()), pygame.SRCALPHA)
-
-        self.img_cache = None
-
-
-        icon = pygame.Surface((self.texture.get_width(), self.texture.get_height()), pygame.SRCALPHA)
-        icon.blit(self.texture_body, (0, 0))
-        icon.blit(self.texture, (0, 0))
-        self.icon = pygame.transform.scale(pygame.transform.rotate(icon,90),(icon_size,icon_size))
-
-    def draw_highlight(self, display, colour):
-        ox, oy = display.position
-
-        # Only draw this Thing if the Thing is within the display
-        bounds = self.get_rect()
-        #print "draw",bounds
-        if self.physics.check_collides((ox, oy, display.width, display.height), bounds):
-            #print "Drawing",self.name
-            minx, miny, w, h = bounds
-            # pygame.draw.rect(display.surface, colour, (minx, miny, w, h), 2)
-            pygame.draw.circle(display.surface, colour, (int(minx+(w>>1)), int(miny+(h>>1))), (w>>1), random.randint(1,4))
-
-
-    def jitter(self, points, amount):
-        result = []
-        for (x, y) in points:
-            x = x * 0.9
-            y = y * 0.9
-            x += (random.random() * amount * float(random.randint(-1, 1)))
-            y += (random.random() * amount * float(random.randint(-1, 1)))
-            # print x,y
-
-            # Clamp
-            if x > 1.0: x = 1.0
-            elif x < -1.0: x = -1.0
-            if y > 1.0: y = 1.0
-            elif y < 0.0: y = 0.0
-            result.append((x,y))
-
-        return result
-
-    def plot_wing(self):
-        #
-
-        bounds = self.get_rect()
-        minx, miny, w, h = bounds
-        cw = w>>1
-        ch = h>>1
-
-        img = pygame.Surface((w,h),pygame.SRCALPHA)
-        img1 = pygame.Surface((w, h), pygame.SRCALPHA)
-        img2 = pygame.Surface((w, h), pygame.SRCALPHA)
-
-        points = []
-        for px, py in self.sub_wing:
-            px = px*float(cw)+cw
-            py = py*float(ch)+ch
-            points.append((px, py)) # Scaled to the dimensions of the image, and offset from centre
-        pygame.draw.polygon(img1, self.colours[1], points, 0)
-        points_sub = points
-
-        points = []
-        for px, py in self.main_wing:
-            px = px*float(cw)+cw
-            py = py*float(ch)+ch
-            points.append((px, py)) # Scaled to the dimensions of the image, and offset from centre
-        pygame.draw.polygon(img2, self.colours[1], points, 0)
-        points_main = points
-
-        offsetx = random.randint(-100,100)
-        offsety = random.randint(-100, 100)
-        for x in xrange(0, img.get_width()):
-            for y in xrange(ch, ch+(img.get_height()>>1)):
-                R,G,B,A = img1.get_at((x,y))
-                if A is not 0:
-                    dx = x-cw+offsetx
-                    dy = y-ch+offsety
-                    val = abs(dx*dy*self.pattern_scaler)
-                    colhere = self.colours[(int(val)%(len(self.colours)-2))+1]
-                    img1.set_at((x,y),colhere)
-
-        offsetx = random.randint(-100,100)
-        offsety = random.randint(-100, 100)
-        for x in xrange(0, img.get_width()):
-            for y in xrange(ch, ch+(img.get_height()>>1)):
-                R,G,B,A = img2.get_at((x,y))
-                if A is not 0:
-                    dx = x-cw+offsetx
-                    dy = y-ch+offsety
-                    val = abs(dx*dy*self.pattern_scaler)
-                    colhere = self.colours[(int(val)%(len(self.colours)-2))+1]
-                    img2.set_at((x,y),colhere)
-
-
-
-        pygame.draw.polygon(img1, self.colours[0], points_sub, 1)
-        pygame.draw.polygon(img2, self.colours[0], points_main, 1)
-        img.blit(img1, (0,0))
-        img.blit(img2, (0,0))
-
-        if False: # Ignore - complications in implementation for now
-            spot_col = self.colours[random.randint(0,len(self.colours)-1)]
-            col_black = Colour().get("black")
-            if self.size > 16:
-                for i in xrange(0,random.randint(5,18)): # Spots!
-                    radius = random.randint(3,8)
-                    # print radius
-                    posx = random.randint(cw>>1, 3*(cw>>1))
-                    posy = random.randint(0, ch>>1)
-                    r2 = radius*radius
-                    for x in xrange(posx-radius, posx+radius+1):
-                        dx = x - posx
-                        for y in xrange(posy - radius, posy + radius + 1):
-                            if 0 <= x < img.get_width() and 0 <= y < img.get_height():
-                                R, G, B, A = img.get_at((x, y))
-                                if A is not 0:
-                                    # print "Hello"
-                                    dy = y-posy
-                                    d2 = dx*dx+dy*dy
-                                    if d2 < r2:
-                                        img.set_at((x, y), col_black)
-                                    elif d2 == r2:
-                                        img.set_at((x, y), col_black)
-
-
-
-        img3 = pygame.transform.flip(img, False, True)
-
-        img.blit(img3, (0,0))
-
-        return img
-
-    def plot_body(self):
-        #
-
-        bounds = self.get_rect()
-        minx, miny, w, h = bounds
-        cw = w>>1
-        ch = h>>1
-
-        img = pygame.Surface((w,h),pygame.SRCALPHA)
-
-        points = []
-        for px, py in self.body:
-            px = px*float(cw)+cw
-            py = py*float(ch)+ch
-            points.append((px, py)) # Scaled to the dimensions of the image, and offset from centre
-        pygame.draw.polygon(img, self.colours[0], points, 0)
-
-        points = []
-        for px, py in self.antennae:
-            px = px*float(cw)+cw
-            py = py*float(ch)+ch
-            points.append((px, py)) # Scaled to the dimensions of the image, and offset from centre
-        pygame.draw.lines(img, self.colours[2], False, points)
-
-
-
-        img2 = pygame.transform.flip(img, False, True)
-
-        img.blit(img2, (0,0))
-
-        # pygame.image.save(img, "butterfly_left_side_body"+self.name+".png")
-        return img
-
-    def create_geometry(self):
-        # Main left wing, if oriented right along the 0 degrees line
-
-        main = [
-                (-0.2, 0.0), (0.2, 0.0), (0.9, 0.8), (1.0, 0.9), (0.9, 1.0), (0.2, 0.8),
-                 (0.1, 0.7), (-0.2, 0.0)
-        ]
-
-        # Sub left wing, if oriented right along the 0 degrees line
-
-        sub = [
-            (-0.02, 0.0), (0.05,0.6), (0.0, 0.8), (-0.3, 0.96), (-0.5, 0.9), (-0.8, 0.6),
-            (-1.0, 0.3), (-0.9, 0.2), (-0.02, 0.0)
-        ]
-
-        # Body segments, if oriented right along the 0 degrees line
-        body = [
-            (0.4, 0.0), (0.38, 0.1), (-0.96, 0.06), (-1.9, 0.0), (0.4, 0.0)
-        ]
-
-        antennae = [
-            (0.4, 0.05), (0.6, 0.2), (1.0, 0.4)
-        ]
-
-        return main, sub, body, antennae
-
-
-    def update(self):
-        self.age += 1
-
-        if self.physics.check_collides(self.position_limits, self.get_rect()):
-            x, y = self.position
-            delta = self.size>>4
-            if delta < 2:
-                delta = 2
-            if not self.selected:
-                x += random.randint(-delta, delta)
-                y += random.randint(-delta, delta)
-
-            self.position = x, y
-
-            if random.randint(1,40) == 1:
-                self.img_cache = None
-                if self.wings_up:
-                    self.wings_up = False
-                else:
-                    self.wings_up = True
-
-            if random.randint(1,10) == 1:
-                self.img_cache = None
-                self.facing = (self.facing + random.randint(-15,15))%360
-
-            if self.selected or self.targeted:
-                self.wings_up = False
-                self.img_cache = None
-
-        else:
-            self.alive = False # Offscreen... FOREVER!
-            self.targeted = False
-            self.selected = False
-            self.wings_up = False
-
-    def draw(self, display):
-        # Work out my position in the world, and how it maps onto the display
-        ox, oy = display.position
-
-        # Only draw this Thing if the Thing is within the display
-        bounds = self.get_rect()
-        #print bounds
-        # print "draw",bounds
-        if self.physics.check_collides((ox, oy, display.width, display.height), bounds):
-            # print "Drawing",self.name
-            minx, miny, w, h = bounds
-            cw = w>>1
-            ch = h>>1
-
-            # Draw the wings and the body
-            final_img = self.img_cache # Avoid rotation if we can
-            if final_img is None: # Rebuild the butterfly
-                # Work out what the plot locations of the creature are based on scales, transforms and rotations
-                self.img_render_buffer.fill((0,0,0,0))
-
-                self.img_render_buffer.blit(self.texture_body, (0,0)) # Body
-
-                wings = self.texture
-                offset = 0
-                if self.wings_up == True:
-                    wings = pygame.transform.scale(self.texture, (w, h>>1))
-                    offset = (h>>2)
-                self.img_render_buffer.blit(wings, (0, 0+offset)) # Wings
-
-                final_img = pygame.transform.rotate(self.img_render_buffer, self.facing)
-                self.img_cache = final_img
-
-            cw = minx+cw
-            ch = miny+ch
-
-            minx = cw-(final_img.get_width()>>1)
-            miny = ch-(final_img.get_height()>>1)
-
-            display.surface.blit(final_img, (minx, miny))
-
-            # pygame.draw.rect(display.surface, self.getColourPrimary(), (minx, miny, w, h))
-
-class Player:
-    def __init__(self):
-        self.score = 0
-        self.inventory = [ Jar(), Jar(), Jar(), Jar()]
-        self.stats = Statistics()
-        self.position = (0,0)
-        self.direction = 0
-        self.speed = 0
-
-    def add_score(self, score):
-        self.score += score
-
-    def draw(self, display):
-        ox, oy = display.position
-
-        # Only draw this Thing if the Thing is within the display
-        bounds = self.get_rect()
-        #print bounds
-        # print "draw",bounds
-        if self.physics.check_collides((ox, oy, display.width, display.height), bounds):
-            # print "Drawing",self.name
-            minx, miny, w, h = bounds
-            cw = w>>1
-            ch = h>>1
-
-
-class Jar():
-    def __init__(self):
-        self.contains = None
-        self.uses = 0
-        self.colour = Colour().get("black")
-
-    def place_in(self, thing):
-        # Replace the contents of the jar with the nominated thing
-        # If there was something in the jar to start with, returns that thing
-
-        result = self.contains
-        if self.contains is None:
-            self.contains = thing
-        self.uses += 1
-
-        return result
-
-    def draw(self, display, rect):
-        # Render this jar within the nominated rectangle
-        # ToDo: Replace with art asset
-
-        colour = self.colour
-
-class Display:
-    def __init__(self, world, size, position):
-        self.age = 0
-
-        self.world = world
-        self.size = size
-        self.width, self.height = self.size
-        self.position = position
-
-        fontlist = pygame.font.get_fonts()
-
-        self.initialised = False
-        self.surface = self.initialiseDisplay(self.world.get_description())
-        self.labelfont = pygame.font.SysFont(fontlist[0], 32)  #random.randint(0,len(fontlist)-1)], 32)
-        self.labelfontbig = pygame.font.SysFont(fontlist[0], 64)  #random.randint(0,len(fontlist)-1)], 64)
-
-
-    def initialiseDisplay(self, description):
-        # print "Creating Surface and Window"
-        pygame.init()
-        pygame.mixer.init()
-        surface = pygame.display.set_mode((self.width, self.height), pygame.SRCALPHA)
-        # print "Converting the surface to optimise rendering"
-        surface.convert()
-        # print "Changing the caption"
-        pygame.display.set_caption(description)
-        self.labelfont = pygame.font.SysFont("monospace", 16)
-        self.labelfontbig = pygame.font.SysFont("monospace", 32)
-        pygame.key.set_repeat(100) # Milliseconds before new key event issued
-        self.initialised = True
-        return surface
-
-    def draw(self):
-        self.surface.fill(self.world.colour_background)
-        for e in self.world.elements:
-            if e.alive:
-                e.draw(self)
-
-    def update(self):
-        self.age += 1
-        unhandledEvents = []
-        events = pygame.event.get()
-        for event in events:
-            if event.type == pygame.MOUSEBUTTONUP:
-                # Clicked on a UI element?
-                unhandledEvents.append(event)
-            elif event.type == pygame.MOUSEBUTTONDOWN:
-                if event.button == 4:  # Scroll
-                    unhandledEvents.append(event)
-                if event.button == 5:  # Scroll
-                    unhandledEvents.append(event)
-                else:
-                    unhandledEvents.append(event)
-
-            elif event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_MINUS or event.key == pygame.K_KP_MINUS:
-                    unhandledEvents.append(event)
-                elif event.key == pygame.K_PLUS or event.key == pygame.K_KP_PLUS or event.key == pygame.K_EQUALS:
-                    unhandledEvents.append(event)
-
-            else:
-                unhandledEvents.append(event)
-
-        pygame.display.update()
-
-        return unhandledEvents
-
-class Statistics:
-    def __init__(self):
-        self.select_fail = 0
-        self.select_success = 0
-
-class Tools:
-    def __init__(self, display, name, rect):
-        self.rect = rect
-        # print self.rect
-        self.name = name
-        self.alive = True
-        self.colour_background = Colour().get("brown")
-        self.colour_border = Colour().get("black")
-        display.world.add_element(self)
-
-    def get_height(self):
-        x,y,w,h = self.rect
-        return h
-
-    def update(self):
-        pass
-
-    def draw(self, display):
-        display.surface.fill(self.colour_background,self.rect)
-        pygame.draw.rect(display.surface, self.colour_border, self.rect, 2)
-
-    def handle_event_click(self, pos):
-        click_x, click_y = pos
-
-        ox, oy, w, h = self.rect
-
-        if ox <= click_x < ox+w and oy <= click_y < oy+h:
-            return True # Within bounds
-
-    def draw_highlight(self, display, colour):
-        pass
-
-class Game:
-    def __init__(self):
-        self.level = 0
-        self.levels =   {
-                            "1": {
-                                "butterflies_max": 3,
-                                "flutter": False,
-                                "timer_max": 10000,
-
-                            },
-
-                        }
-
-    def get_level(self, level):
-        return self.levels[str(level)]
-
-
-def main_loop():
-    display = Display(World("Butterflies"), (800,800), (0,0))
-    logo_img = pygame.image.load("WF4_t_w.png")
-    logo = logo_img
-    logo_shrink = 0
-    logo_max_shrink = logo_img.get_width()>>1
-    ui_colours = Colour()
-
-    display_world_region = (0,0,display.surface.get_width(),display.surface.get_height())
-
-
-
-    # Main loop
-    pygame.mixer_music.load("abmusic.mp3")
-    pygame.mixer_music.play(-1)
-
-
-    player = Player()
-
-
-
-    instructions_done = False
-
-    particles = []
-    scoreticles = []
-    selected = None
-    targeted = None
-    keepGoing = True
-    iterationCount = 0
-
-    MAX_ITEMS = 30
-    for i in xrange(0,random.randint(10,50)):
-        Butterfly(display, ("Thing"+str(i)), display_world_region)
-    fadeText = []
-    targets = []
-    level = 0
-    mousepos = -999,-999 # Default
-    while keepGoing:
-        if iterationCount%8000 == 0:
-            level += 1
-            fadeText.append(("LEVEL "+str(level),255))
-        if iterationCount > 300 and logo_shrink < logo_max_shrink:
-            logo = pygame.transform.scale(logo_img,(logo_img.get_width()-logo_shrink, logo_img.get_height()-logo_shrink))
-            logo_shrink += 1
-        #if iterationCount % 10000 == 0:
-        #    print "Number of elements",len(display.world.elements)
-
-        iterationCount += 1
-
-        potentials = display.world.get_elements()
-        if iterationCount %500 == 0:
-            if random.randint(1, 10) == 1 and len(targets) > 0:
-                targets.pop(0)
-            if len(potentials) > 0:
-                potential = potentials[random.randint(0, len(potentials) - 1)]
-                if potential.alive and potential not in targets:
-                    targets.append(potential)  # Add a new target
-
-        if len(potentials) < MAX_ITEMS:
-            if random.randint(1,100) == 1:
-                Butterfly(display, ("Butterfly"), display_world_region)
-
-
-
-        # Tick the world
-        # print "Ticking",len(display.world.elements)
-        display.world.tick()
-
-        # Draw the world
-        #print "Drawing",len(display.world.elements)
-        # Object rendering
-        display.draw()
-        # Special UI hints to the player
-        if selected is not None and selected.alive:
-            selected.draw_highlight(display, (136, 255, 242, random.randint(30,170)) )  # Red
-        if targeted is not None and targeted.alive:
-            targeted.draw_highlight(display, ui_colours.get("green") )  # Green
-
-        cursor_x = 2
-        newTargets = []
-        for s in targets:
-            # Draw targeting object
-            if s.icon is not None and s.alive:
-                display.surface.blit(s.icon,(cursor_x, 2))
-
-                if instructions_done == False: # Hint for the player
-                    s.draw_highlight(display, (136, 255, 242, random.randint(30, 170)))
-                    pygame.draw.line(display.surface, (136, 255, 242, random.randint(30, 170)), (0,s.icon.get_height()+2), (display.surface.get_width()>>1,s.icon.get_height()+2))
-
-                # Is there a match?
-                if s.physics.check_collides(s.get_rect(), (cursor_x,2,s.icon.get_width(),s.icon.get_height())):
-                    # print "Matched!"
-                    score = s.size*10
-                    centre_pos = (cursor_x+(s.icon.get_width()>>1),(s.icon.get_height()>>1))
-                    # print len(targets)
-                    if len(targets) == 1:
-                        # score += player.score
-                        score += score*(level+1)
-                        score_img = display.labelfont.render("! CLEAR BONUS x"+str(level)+" !", 1, (255, 255, 255, 255))
-                        scoreticles.append((((display.surface.get_width()>>1)-(score_img.get_width()>>1),score_img.get_height()>>1), 0.6, score_img))
-                    player.add_score(score)
-
-                    score_img = display.labelfont.render(str(int(score)), 1, (255, 255, 255, 255))
-                    scoreticles.append((centre_pos, 0.3, score_img ))
-
-                    s.alive = False
-
-                    if len(particles) < 30:
-                        for i in xrange(0, random.randint(5,15)):
-                            particles.append((centre_pos, 0.3-random.random()*(0.6), 0.1-random.random()*0.2))
-                else:
-                    newTargets.append(s)
-                cursor_x += 2 + s.icon.get_width()
-        targets = newTargets
-
-        newFadeText = []
-        for f in fadeText:
-            text, counter = f
-            counter -= 1
-            if counter > 0:
-                text_img = display.labelfontbig.render(text, 1, (counter%255, counter%255, counter%255, 255))
-                display.surface.blit(text_img, ((display.surface.get_width()>>1)-(text_img.get_width()>>1),(display.surface.get_height()>>1)-(text_img.get_height()>>1)))
-                newFadeText.append((text, counter))
-        fadeText = newFadeText
-
-        newParticles = []
-        for p in particles:
-            (x, y), dx, dy = p
-            pygame.draw.circle(display.surface, (255, 255, 255, 255), (int(x),int(y)), random.randint(2,5), 0)
-            x += dx
-            y += dy
-            dy += 0.01
-            if 0 <= x < display.surface.get_width() and 0 <= y < display.surface.get_height():
-                newParticles.append(((x,y), dx, dy))
-        particles = newParticles
-
-        newScores = []
-        for s in scoreticles:
-            (x,y), dy, score_img = s
-            y += dy
-            dy += 0.01
-            if y < display.surface.get_height():
-                display.surface.blit(score_img,(x,y))
-                newScores.append(((x,y),dy,score_img))
-        scoreticles = newScores
-
-
-        # HUD
-
-        scorelabel_w = display.labelfontbig.render(str(int(player.score)), 1, (255, 255, 255, 255))
-        scorelabel_b = display.labelfontbig.render(str(int(player.score)), 1, (0, 0, 0, 128))
-        slw = scorelabel_w.get_width()
-        slh = scorelabel_w.get_height()
-        display.surface.blit(scorelabel_b, ((display.surface.get_width()>>1)-(slw>>1), display.surface.get_height()-slh))
-        display.surface.blit(scorelabel_w,
-                             ((display.surface.get_width() >> 1) - (slw >> 1)-4, display.surface.get_height() - slh-4))
-
-        if iterationCount == 500 or ((iterationCount %800 == 0) and instructions_done == False): # Repeat if no click
-            score_img = display.labelfont.render("Left click select & move to match butterflies", -20, (136, 255, 242, random.randint(30,170)))
-            scoreticles.append((((display.surface.get_width() >> 1) - (score_img.get_width() >> 1),
-                                 64), 0.6, score_img))
-
-        display.surface.blit(logo, (display.surface.get_width()-logo.get_width(),0))
-
-        # Event loop
-
-        for event in display.update():
-            if event.type == pygame.QUIT:
-                return False
-            elif event.type == pygame.MOUSEMOTION:
-                mousepos = event.pos
-                if selected is not None:
-                    selected.position = mousepos
-                    # print selected.position
-            elif event.type == pygame.MOUSEBUTTONDOWN:
-                instructions_done = True
-                for e in display.world.get_elements():
-                    if e.alive:
-                        if( e.handle_event_click(event.pos) ):
-                            selected = e
-                            e.selected = True
-                            player.stats.select_success += 1
-                            break
-
-            elif event.type == pygame.MOUSEBUTTONUP:
-                    if selected is not None:
-                        selected.selected = False
-                        selected = None
-            else:
-                pass
-                # print event # Placeholder
-
-
-
-if __name__ == '__main__':
-    main_loop()
-
+# @TheWorldFoundry
+# 2020-09-27
+#   - Interaction UI simplified - now: click, drag, release
+#   - Disabled 'jitter' when a butterfly is selected, allowing easier shape and pattern compare for player
+#   - Scoring change to "x level" instead of doubling player score on row clear
+#   - Remove reference to right-click release as game is now one-touch for all button types
+# 2026-10-17
+#   - Wing patterns plotted a whole surface at a time through surfarray when numpy is available
+#   - Butterflies are generated from their own seed on background threads and join the world when ready
+#   - Rotated butterfly frames kept in a shared atlas (every 5 degrees, wings up and down) under a memory budget
+#   - Butterfly looks come from a seeded Genome; --texture-cache keeps their textures on disk by genome hash, LRU under a cap
+#   - World keeps a spatial grid for clicks (topmost butterfly wins), viewport culling and target matching
+#   - Optional numpy Swarm simulates every butterfly in a World at once, for populations in the tens of thousands (--swarm)
+#   - main_loop split into Game phases; --headless --seed --frames runs without a window, sound or logo
+#   - PROFILER times each phase and counts rotations, texture builds, font renders and blits. F3 shows it, --profile saves it
+#   - Fixed 120Hz simulation ticks, frames capped at 60fps and drawn between ticks, with catch-up and frame skip limits
+#   - Optional dirty rect rendering (--dirty-rects) redraws and updates only what changed since the last frame
+#   - Text is rendered once and cached; numbers are put together from cached digit glyphs and fade text fades by alpha
+#   - Particles and score popups live in fixed size array pools, moved all at once and drawn from pre-rendered sprites
+#   - Things, Butterflies, Jars and Tools use __slots__ and share one Physics, one palette and one set of outlines
+#   - Butterfly textures and rotated frames are shared per genome, counted, and freed when the last one leaves the world
+#   - --quality lod/low rasterises wings at a few canonical sizes and scales them up, rather than at every radius
+#   - TargetTracker keeps the target bar's slots and only tests targets that moved since the last tick
+#   - --record saves a session's seed and mouse events; --replay plays it back headless at full speed
+#   - Startup shows a frame straight away; fonts, logo, music and the first butterflies load behind a progress bar
+#   - The logo's shrink animation draws keyframes scaled once at load, then one reused buffer, not a new surface a tick
+#   - Drawing goes through a RenderQueue: layered (world, held, targets, effects, HUD), culled, one blits() per layer
+#   - --shards N simulates the world in N processes, strip by strip, handing butterflies over as they cross strips
+#   - Wings carry spots, eyespots and veins from the genome, painted from distance fields (the old spots code is gone)
+#   - Textures, text, particles and the logo are converted to the display's format: colour keyed RLE where they can be
+#   - generate.py bakes seed ranges of butterflies into sprite sheets with a JSON index, on every core. Genome.to_dict/from_dict
+#     --seeds spawns from such a range, so with --texture-cache the game loads their textures rather than drawing them
+#   - A Governor scales the population, spawn rate, particles, rotation steps and texture detail to hold 60fps (--fixed-quality for off)
+
+
+import pygame
+import random
+import math
+import multiprocessing
+import multiprocessing.sharedctypes
+import os
+import time
+import argparse
+import bisect
+import collections
+import csv
+import functools
+import json
+import hashlib
+import struct
+import threading
+import traceback
+import Queue
+
+try:
+    import numpy
+except ImportError:
+    numpy = None  # Optional - without it wing patterns are plotted a pixel at a time
+
+WING_PATTERN_ARRAYS = numpy is not None
+SAMPLES_DIR = "samples"  # Each newly rasterised butterfly is saved here if the folder exists
+MAX_SEED = 0x7fffffff
+GENOME_VERSION = 2  # Bump when a change to the rasteriser means cached textures should be redrawn
+
+# Texture level of detail: (radii, scaler). Wings are rasterised at the nearest of the radii at or below the
+# butterfly's own, then scaled up to size. None draws every radius as it is
+QUALITY_LEVELS = collections.OrderedDict([
+    ("full", (None, None)),
+    ("lod", ((32, 48, 64, 96), pygame.transform.smoothscale)),
+    ("low", ((32, 64), pygame.transform.scale)),
+])
+TEXTURE_QUALITY = "full"
+
+class Profiler:
+    # Section timings and counters, kept per frame over a rolling window. While disabled every call
+    # returns straight away, so the hooks can stay in the hot paths
+    TIME_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 33, 66) # Milliseconds
+    COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+    def __init__(self, history=300):
+        self.enabled = False
+        self.recording = False # Keep timing while the overlay is hidden, e.g. to export on the way out
+        self.history = history
+        self.starts = {}
+        self.frame = {} # name: ms or count so far this frame
+        self.counters = set() # Names that are counts rather than timings
+        self.series = collections.OrderedDict() # name: the last 'history' frames
+        self.times = collections.deque(maxlen=history) # When each of those frames ended
+
+    def start(self, section):
+        if self.enabled:
+            self.starts[section] = time.time()
+
+    def stop(self, section):
+        if self.enabled and section in self.starts:
+            self.frame[section] = self.frame.get(section, 0.0) + (time.time() - self.starts.pop(section)) * 1000.0
+
+    def count(self, counter, amount=1):
+        if self.enabled:
+            self.counters.add(counter)
+            self.frame[counter] = self.frame.get(counter, 0) + amount
+
+    def end_frame(self):
+        if not self.enabled:
+            return
+        frame = self.frame
+        self.frame = {}
+        for name in frame:
+            if name not in self.series:
+                self.series[name] = collections.deque(maxlen=self.history)
+        for name, values in self.series.items():
+            values.append(frame.get(name, 0))
+        if self.times.maxlen != self.history:
+            self.times = collections.deque(self.times, maxlen=self.history)
+        self.times.append(time.time())
+
+    def reset(self):
+        self.frame = {}
+        self.series.clear()
+        self.times.clear()
+
+    def rate(self, name):
+        # A counter's average per second of wall clock over the window
+        values = self.series.get(name, ())
+        if len(values) == 0 or len(self.times) < 2:
+            return 0.0
+        frames_per_second = (len(self.times) - 1) / max(self.times[-1] - self.times[0], 1e-9)
+        return sum(values) / float(len(values)) * frames_per_second
+
+    def percentile(self, name, fraction):
+        values = sorted(self.series.get(name, ()))
+        if len(values) == 0:
+            return 0
+        return values[min(int(fraction * len(values)), len(values) - 1)]
+
+    def histogram(self, name):
+        buckets = self.COUNT_BUCKETS if name in self.counters else self.TIME_BUCKETS
+        counts = [0] * (len(buckets) + 1)
+        for value in self.series.get(name, ()):
+            counts[bisect.bisect_left(buckets, value)] += 1
+        labels = ["<="+str(b) for b in buckets] + [">"+str(buckets[-1])]
+        return collections.OrderedDict(zip(labels, counts))
+
+    def report(self):
+        lines = []
+        for name in self.series:
+            if name in self.counters:
+                lines.append("%-16s %5d %5d %7.1f/s" % (name, self.percentile(name, 0.5), self.percentile(name, 1.0), self.rate(name)))
+            else:
+                lines.append("%-16s %5.2f %5.2f" % (name, self.percentile(name, 0.5), self.percentile(name, 0.99)))
+        return lines
+
+    def export(self, filename):
+        stats = collections.OrderedDict()
+        for name in self.series:
+            stats[name] = collections.OrderedDict([
+                ("unit", "count" if name in self.counters else "ms"),
+                ("p50", self.percentile(name, 0.5)),
+                ("p99", self.percentile(name, 0.99)),
+                ("max", self.percentile(name, 1.0)),
+                ("per_second", self.rate(name) if name in self.counters else None),
+                ("histogram", self.histogram(name)),
+            ])
+        with open(filename, "w") as f:
+            if filename.endswith(".csv"):
+                writer = csv.writer(f)
+                writer.writerow(["name", "unit", "p50", "p99", "max", "per_second", "histogram"])
+                for name, row in stats.items():
+                    writer.writerow([name, row["unit"], row["p50"], row["p99"], row["max"], row["per_second"]] + ["%s:%d" % bucket for bucket in row["histogram"].items()])
+            else:
+                json.dump(stats, f, indent=2)
+
+PROFILER = Profiler()
+
+class Colour:
+    def __init__(self):
+        self.colours = {
+            "black": (0x05, 0x03, 0x09, 0xff),
+            "white": (0xff, 0xff, 0xff, 0xff),
+            "green": (0x00, 0xa0, 0x00, 0xff),
+            "red": (0xa0, 0x00, 0x00, 0xff),
+            "brown": (0x70, 0x60, 0x70, 0xff),
+            "transparent": (0x00, 0x00, 0x00, 0xff),
+            "world_background": (0x80, 0x70, 0x90, 0xff)
+        }
+
+    def get(self, key, rng=random):
+        if key not in self.colours:
+            # Issue a new random colour if we didn't find the requested one
+            self.colours[key] = Colour.random(rng)
+        return self.colours[key]
+
+    @staticmethod
+    def random(rng=random):
+        return (128+rng.randint(0, 127), 128+rng.randint(0, 127), 128+rng.randint(0, 127), 255)
+
+PALETTE = Colour() # Shared named colours. Genome.generate keeps its own, as it adds random ones as it goes
+
+class Physics:
+    # Stateless - one instance is shared by every Thing
+    @staticmethod
+    def check_collides(rect_a, rect_b):
+        ox_a, oy_a, w_a, h_a = rect_a
+        ox_b, oy_b, w_b, h_b = rect_b
+
+        # Assume we have collided, then prove if we haven't
+        if ox_a + w_a -1 <= ox_b:
+            return False
+        elif ox_a >= ox_b + w_b:
+            return False
+        elif oy_a + h_a <= oy_b:
+            return False
+        elif oy_a >= oy_b + h_b:
+            return False
+        return True # Has collided
+
+class SpatialGrid:
+    # Uniform grid over the world. Each cell knows the elements whose bounding box touches it
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {} # (column, row): set of elements
+        self.element_cells = {} # element: the cells it is in
+        self.physics = Physics()
+
+    def cells_for(self, rect):
+        ox, oy, w, h = rect
+        cs = self.cell_size
+        x0 = int(ox)//cs
+        y0 = int(oy)//cs
+        x1 = int(ox+w-1)//cs
+        y1 = int(oy+h-1)//cs
+        return tuple((x, y) for x in xrange(x0, x1+1) for y in xrange(y0, y1+1))
+
+    def insert(self, element):
+        cells = self.cells_for(element.get_rect())
+        self.element_cells[element] = cells
+        for cell in cells:
+            self.cells.setdefault(cell, set()).add(element)
+
+    def move(self, element):
+        # Only elements already in the grid are tracked, and only a change of cell costs anything
+        cells = self.element_cells.get(element)
+        if cells is None:
+            return
+        new_cells = self.cells_for(element.get_rect())
+        if new_cells != cells:
+            self.remove(element)
+            self.element_cells[element] = new_cells
+            for cell in new_cells:
+                self.cells.setdefault(cell, set()).add(element)
+
+    def remove(self, element):
+        for cell in self.element_cells.pop(element, ()):
+            members = self.cells[cell]
+            members.discard(element)
+            if len(members) == 0:
+                del self.cells[cell]
+
+    def query_rect(self, rect):
+        found = set()
+        for cell in self.cells_for(rect):
+            members = self.cells.get(cell)
+            if members is not None:
+                found.update(members)
+        return [e for e in found if self.physics.check_collides(rect, e.get_rect())]
+
+    def query_point(self, pos):
+        x, y = pos
+        cs = self.cell_size
+        members = self.cells.get((int(x)//cs, int(y)//cs), ())
+        return [e for e in members if e.handle_event_click(pos)]
+
+class World:
+    def __init__(self, description, swarm=False, shards=0):
+        self.description = description
+        self.elements = []
+        self.colour_background = PALETTE.get("world_background")
+        self.regions = []
+        self.index = SpatialGrid(128)
+        self.next_z = 0 # Draw order. Later elements are drawn on top
+        self.swarm = None
+        if swarm: # Simulate butterflies a whole array at a time instead of one update() each
+            self.swarm = Swarm(self, random.randint(0, MAX_SEED))
+        elif shards > 0: # Or with the world cut into strips, each simulated in a process of its own
+            self.swarm = Shards(self, random.randint(0, MAX_SEED), shards)
+        self.changed = None # Elements moved or dropped since take_changed, once track_changes is called
+
+    def track_changes(self):
+        if self.changed is None:
+            self.changed = set()
+
+    def take_changed(self):
+        changed = self.changed
+        self.changed = set()
+        return changed
+
+    def get_description(self):
+        return self.description
+
+    def close(self):
+        if self.swarm is not None:
+            self.swarm.close()
+
+    def add_element(self, element):
+        element.z = self.next_z
+        self.next_z += 1
+        self.elements.append(element)
+        self.index.insert(element)
+        if self.swarm is not None and isinstance(element, Butterfly):
+            self.swarm.add(element)
+        if self.changed is not None:
+            self.changed.add(element)
+
+    def element_moved(self, element):
+        self.index.move(element)
+        if element.swarm_slot is not None:
+            self.swarm.place(element)
+        if self.changed is not None:
+            self.changed.add(element)
+
+    def get_elements(self):
+        return self.elements
+
+    def query_rect(self, rect):
+        # Live elements overlapping the rect, bottom to top
+        found = [e for e in self.index.query_rect(rect) if e.alive]
+        found.sort(key=lambda e: e.z)
+        return found
+
+    def query_point(self, pos):
+        # Live elements under the point, topmost first
+        found = [e for e in self.index.query_point(pos) if e.alive]
+        found.sort(key=lambda e: e.z, reverse=True)
+        return found
+
+    def tick(self):
+        if self.swarm is not None:
+            self.swarm.tick()
+        newElements = []
+        for e in self.elements:
+            if e.alive:
+                if e.swarm_slot is None:
+                    e.update()
+                newElements.append(e)
+            else:
+                self.index.remove(e)
+                e.release()
+                if self.changed is not None:
+                    self.changed.add(e)
+        self.elements = newElements
+
+class Swarm:
+    # Structure of arrays version of Butterfly.update for very large populations. Positions, sizes, facing,
+    # wing state and the alive/selected/targeted flags live in numpy arrays and every butterfly is moved in one go
+    # each tick. Members read their position, facing and wings from lists built from the arrays once a tick, rather
+    # than each being written back. The rolls follow the same odds as Butterfly.update, drawn from the swarm's own generator
+    ARRAYS = ("x", "y", "size", "facing", "wings_up", "alive", "selected", "targeted", "joined", "limits", "cells")
+
+    def __init__(self, world, seed, capacity=256):
+        if numpy is None:
+            raise RuntimeError("The swarm simulation needs numpy")
+        self.world = world
+        self.rng = numpy.random.RandomState(seed)
+        self.members = []
+        self.ticks = 0
+        self.x = numpy.zeros(capacity, dtype=numpy.int64)
+        self.y = numpy.zeros(capacity, dtype=numpy.int64)
+        self.size = numpy.zeros(capacity, dtype=numpy.int64)
+        self.facing = numpy.zeros(capacity, dtype=numpy.int64)
+        self.wings_up = numpy.zeros(capacity, dtype=bool)
+        self.alive = numpy.zeros(capacity, dtype=bool)
+        self.selected = numpy.zeros(capacity, dtype=bool)
+        self.targeted = numpy.zeros(capacity, dtype=bool)
+        self.joined = numpy.zeros(capacity, dtype=numpy.int64) # Tick each member joined, to settle its age when it leaves
+        self.limits = numpy.zeros((capacity, 4), dtype=numpy.int64) # position_limits rect of each member
+        self.cells = numpy.zeros((capacity, 4), dtype=numpy.int64) # Grid cells its rect spans, first and last, to spot index moves
+        # What the members read, by slot
+        self.positions = []
+        self.last_positions = []
+        self.facings = []
+        self.wings = []
+
+    def grow(self):
+        for name in Swarm.ARRAYS:
+            old = getattr(self, name)
+            new = numpy.zeros((len(old)<<1,)+old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def add(self, butterfly):
+        slot = len(self.members)
+        if slot == len(self.x):
+            self.grow()
+        self.members.append(butterfly)
+        self.x[slot], self.y[slot] = butterfly._position
+        self.size[slot] = butterfly.size
+        self.facing[slot] = butterfly._facing
+        self.wings_up[slot] = butterfly._wings_up
+        self.alive[slot] = butterfly._alive
+        self.selected[slot] = butterfly._selected
+        self.targeted[slot] = butterfly._targeted
+        self.joined[slot] = self.ticks
+        self.limits[slot] = butterfly.position_limits
+        self.cells[slot] = self.cell_of(self.x[slot], self.y[slot], self.size[slot])
+        self.positions.append(butterfly._position)
+        self.last_positions.append(butterfly._last_position)
+        self.facings.append(butterfly._facing)
+        self.wings.append(butterfly._wings_up)
+        butterfly.swarm_slot = slot
+
+    def settle(self, butterfly):
+        # Leaving the swarm: the butterfly gets its own copy of what the swarm knew about it
+        slot = butterfly.swarm_slot
+        butterfly._position = self.positions[slot]
+        butterfly._last_position = self.last_positions[slot]
+        butterfly._facing = self.facings[slot]
+        butterfly._wings_up = self.wings[slot]
+        butterfly.age += self.ticks - int(self.joined[slot])
+        butterfly.swarm_slot = None
+
+    def cell_of(self, x, y, size):
+        # As SpatialGrid.cells_for(get_rect()): the columns and rows of the first and last cells the rect touches
+        cs = self.world.index.cell_size
+        return (x-size)//cs, (y-size)//cs, (x+size-1)//cs, (y+size-1)//cs
+
+    def flag(self, butterfly):
+        # The game changed alive, selected or targeted
+        slot = butterfly.swarm_slot
+        self.alive[slot] = butterfly._alive
+        self.selected[slot] = butterfly._selected
+        self.targeted[slot] = butterfly._targeted
+
+    def place(self, butterfly):
+        # Someone moved a member directly, e.g. the player dragging it
+        slot = butterfly.swarm_slot
+        self.x[slot], self.y[slot] = butterfly._position
+        self.positions[slot] = butterfly._position
+        self.cells[slot] = self.cell_of(self.x[slot], self.y[slot], self.size[slot])
+
+    def compact(self, keep):
+        # Drop the members that are no longer alive, keeping the rest in order
+        n = len(self.members)
+        kept = keep.tolist()
+        for butterfly, k in zip(self.members, kept):
+            if not k:
+                self.settle(butterfly)
+        self.members = [m for m, k in zip(self.members, kept) if k]
+        for slot, butterfly in enumerate(self.members):
+            butterfly.swarm_slot = slot
+        for name in Swarm.ARRAYS:
+            array = getattr(self, name)
+            array[:len(self.members)] = array[:n][keep]
+        for name in ("positions", "last_positions", "facings", "wings"):
+            setattr(self, name, [v for v, k in zip(getattr(self, name), kept) if k])
+
+    @staticmethod
+    def step(rng, x, y, size, facing, wings_up, limits, selected, held):
+        # One tick for arrays of butterflies, changing x, y, facing and wings_up in place.
+        # Returns which were inside their limits, which moved and which need drawing again
+        n = len(x)
+
+        # Physics.check_collides(position_limits, get_rect()) for everyone at once
+        rx = x - size
+        ry = y - size
+        w = size<<1
+        lx, ly, lw, lh = limits.T
+        inside = ~((lx + lw - 1 <= rx) | (lx >= rx + w) | (ly + lh <= ry) | (ly >= ry + w))
+
+        delta = numpy.maximum(size>>4, 2)
+        moving = inside & ~selected
+        x += numpy.where(moving, (rng.random_sample(n) * (2*delta+1)).astype(numpy.int64) - delta, 0)
+        y += numpy.where(moving, (rng.random_sample(n) * (2*delta+1)).astype(numpy.int64) - delta, 0)
+
+        flutter = inside & (rng.random_sample(n) < 1/40.0)
+        wings_up ^= flutter
+        turn = inside & (rng.random_sample(n) < 1/10.0)
+        facing[:] = numpy.where(turn, (facing + rng.randint(-15, 16, n)) % 360, facing)
+        wings_up &= ~(held | ~inside)
+        return inside, moving, flutter | turn | held
+
+    def close(self):
+        pass
+
+    def tick(self):
+        n = len(self.members)
+        if not self.alive[:n].all():
+            self.compact(self.alive[:n].copy())
+        members = self.members
+        n = len(members)
+        if n == 0:
+            return
+        self.ticks += 1
+        selected = self.selected[:n]
+        held = selected | self.targeted[:n]
+        x = self.x[:n]
+        y = self.y[:n]
+        size = self.size[:n]
+        facing = self.facing[:n]
+        wings_up = self.wings_up[:n]
+        inside, moving, redraw = self.step(self.rng, x, y, size, facing, wings_up, self.limits[:n], selected, held)
+
+        cells = numpy.stack(self.cell_of(x, y, size), axis=1)
+        regrid = (cells != self.cells[:n]).any(axis=1)
+        self.cells[:n] = cells
+
+        # What the members will read, all at once
+        self.last_positions = self.positions
+        self.positions = zip(x.tolist(), y.tolist())
+        self.facings = facing.tolist()
+        self.wings = wings_up.tolist()
+        for slot in numpy.flatnonzero(redraw).tolist():
+            members[slot].img_cache = None
+        gone = ~inside
+        if gone.any():
+            self.alive[:n] &= inside
+            selected &= inside
+            self.targeted[:n] &= inside
+            for slot in numpy.flatnonzero(gone).tolist():
+                m = members[slot]
+                m._alive = False # Offscreen... FOREVER!
+                m._targeted = False
+                m._selected = False
+        index = self.world.index
+        for slot in numpy.flatnonzero(regrid).tolist():
+            index.move(members[slot])
+        if self.world.changed is not None:
+            self.world.changed.update([members[slot] for slot in numpy.flatnonzero(moving | gone).tolist()])
+
+class Shards:
+    # Swarm's simulation spread over worker processes. The world is cut into vertical strips 'strip' pixels wide,
+    # dealt round the shards in turn, and each shard's process ticks the butterflies in its strips with Swarm.step.
+    # One that flies into another shard's strip is handed over to that shard for the next tick. Workers write each
+    # member's position, facing and flags into shared memory, and that snapshot is all this process reads back:
+    # as lists built from it once a tick, which members read while they are sharded, as they would from a Swarm
+    WINGS_UP, INSIDE, MOVED, REDRAW = 1, 2, 4, 8
+
+    def __init__(self, world, seed, count, strip=256, capacity=1<<16):
+        if numpy is None:
+            raise RuntimeError("The sharded simulation needs numpy")
+        self.world = world
+        self.count = count
+        self.strip = strip
+        self.ticks = 0
+        self.shared = multiprocessing.sharedctypes.RawArray("i", capacity*4) # x, y, facing, flags for each slot
+        self.snapshot = numpy.frombuffer(self.shared, dtype=numpy.int32).reshape(capacity, 4)
+        self.members = [None] * capacity # slot: butterfly
+        self.used = numpy.zeros(capacity, dtype=bool)
+        self.free = list(xrange(capacity-1, -1, -1)) # Lowest first, so the slots in use stay packed at the start
+        self.high = 0 # One past the highest slot used so far
+        self.owner = numpy.zeros(capacity, dtype=numpy.int64) # Shard simulating each slot
+        self.size = numpy.zeros(capacity, dtype=numpy.int64)
+        self.alive = numpy.zeros(capacity, dtype=bool)
+        self.selected = numpy.zeros(capacity, dtype=bool)
+        self.targeted = numpy.zeros(capacity, dtype=bool)
+        self.joined = numpy.zeros(capacity, dtype=numpy.int64) # Tick each member joined, to settle its age when it leaves
+        self.cells = numpy.zeros((capacity, 4), dtype=numpy.int64) # Grid cells its rect spans, first and last, to spot index moves
+        # What the members read, by slot, up to high
+        self.positions = []
+        self.last_positions = []
+        self.facings = []
+        self.wings = []
+        # Changes for each shard, sent along with the next tick
+        self.adds = [[] for shard in xrange(count)]
+        self.removes = [[] for shard in xrange(count)]
+        self.places = [[] for shard in xrange(count)]
+        self.connections = []
+        self.processes = []
+        for shard in xrange(count):
+            connection, worker_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=shard_worker, name="Shard"+str(shard),
+                                              args=(worker_connection, self.shared, capacity, shard, count, strip, seed+shard))
+            process.daemon = True
+            process.start()
+            self.connections.append(connection)
+            self.processes.append(process)
+
+    def shard_of(self, x):
+        return (int(x)//self.strip) % self.count
+
+    def cell_of(self, x, y, size):
+        # As Swarm.cell_of
+        cs = self.world.index.cell_size
+        return (x-size)//cs, (y-size)//cs, (x+size-1)//cs, (y+size-1)//cs
+
+    def add(self, butterfly):
+        if len(self.free) == 0:
+            raise RuntimeError("No room for more than %d sharded butterflies" % len(self.members))
+        slot = self.free.pop()
+        if slot >= self.high:
+            grown = slot + 1 - self.high
+            for values in (self.positions, self.last_positions, self.facings, self.wings):
+                values.extend([None] * grown)
+            self.high = slot + 1
+        self.members[slot] = butterfly
+        self.used[slot] = True
+        x, y = butterfly._position
+        self.size[slot] = butterfly.size
+        self.alive[slot] = butterfly._alive
+        self.selected[slot] = butterfly._selected
+        self.targeted[slot] = butterfly._targeted
+        self.joined[slot] = self.ticks
+        self.cells[slot] = self.cell_of(x, y, butterfly.size)
+        self.positions[slot] = butterfly._position
+        self.last_positions[slot] = butterfly._last_position
+        self.facings[slot] = butterfly._facing
+        self.wings[slot] = butterfly._wings_up
+        butterfly.swarm_slot = slot
+        self.hand_to(self.shard_of(x), slot)
+
+    def hand_to(self, shard, slot):
+        b = self.members[slot]
+        self.owner[slot] = shard
+        self.adds[shard].append((slot,)+tuple(b.position)+(b.size, b.facing, int(b.wings_up))+tuple(b.position_limits))
+
+    def place(self, butterfly):
+        # Someone moved a member directly, e.g. the player dragging it
+        slot = butterfly.swarm_slot
+        x, y = butterfly._position
+        self.positions[slot] = butterfly._position
+        self.places[self.owner[slot]].append((slot, x, y))
+        self.cells[slot] = self.cell_of(x, y, self.size[slot])
+
+    def flag(self, butterfly):
+        # The game changed alive, selected or targeted
+        slot = butterfly.swarm_slot
+        self.alive[slot] = butterfly._alive
+        self.selected[slot] = butterfly._selected
+        self.targeted[slot] = butterfly._targeted
+
+    def release(self, slot):
+        # Changes still waiting to go to the slot's shard go too, or a handed over member would come back as a ghost
+        shard = self.owner[slot]
+        self.adds[shard] = [add for add in self.adds[shard] if add[0] != slot]
+        self.places[shard] = [place for place in self.places[shard] if place[0] != slot]
+        m = self.members[slot]
+        m._position = self.positions[slot] # Its own copy of what the shards knew about it
+        m._last_position = self.last_positions[slot]
+        m._facing = self.facings[slot]
+        m._wings_up = self.wings[slot]
+        m.age += self.ticks - int(self.joined[slot])
+        m.swarm_slot = None
+        self.members[slot] = None
+        self.used[slot] = False
+        self.free.append(slot)
+
+    def tick(self):
+        high = self.high
+        used = self.used[:high]
+        for slot in numpy.flatnonzero(used & ~self.alive[:high]).tolist():
+            self.removes[self.owner[slot]].append(slot)
+            self.release(slot)
+        selected = numpy.flatnonzero(used & self.selected[:high]).tolist()
+        held = numpy.flatnonzero(used & self.targeted[:high]).tolist()
+        for shard, connection in enumerate(self.connections):
+            connection.send((self.removes[shard], self.adds[shard], self.places[shard], selected, held))
+            self.removes[shard], self.adds[shard], self.places[shard] = [], [], []
+        replies = [connection.recv() for connection in self.connections] # Every shard ticks at once
+        self.ticks += 1
+
+        # What the members will read, all at once. Slots not in use read nothing, so their junk is harmless
+        members = self.members
+        x, y, facing, flags = self.snapshot[:high].astype(numpy.int64).T
+        self.last_positions = self.positions
+        self.positions = zip(x.tolist(), y.tolist())
+        self.facings = facing.tolist()
+        self.wings = ((flags & self.WINGS_UP) != 0).tolist()
+
+        slots = numpy.flatnonzero(used)
+        x, y, flags = x[slots], y[slots], flags[slots]
+        for slot in slots[(flags & self.REDRAW) != 0].tolist():
+            members[slot].img_cache = None
+        cells = numpy.stack(self.cell_of(x, y, self.size[slots]), axis=1)
+        regrid = (cells != self.cells[slots]).any(axis=1)
+        self.cells[slots] = cells
+        index = self.world.index
+        for slot in slots[regrid].tolist():
+            index.move(members[slot])
+        if self.world.changed is not None:
+            self.world.changed.update([members[slot] for slot in slots[(flags & (self.MOVED|self.INSIDE)) != self.INSIDE].tolist()])
+
+        PROFILER.count("handoffs", sum(len(left) for left, gone in replies))
+        for left, gone in replies:
+            for slot in left:
+                if members[slot] is not None:
+                    self.hand_to(self.shard_of(members[slot].position[0]), slot)
+            for slot in gone: # The shard has already let go of these
+                m = members[slot]
+                if m is None:
+                    continue
+                m._alive = False # Offscreen... FOREVER!
+                m._targeted = False
+                m._selected = False
+                self.alive[slot] = self.selected[slot] = self.targeted[slot] = False
+                self.release(slot)
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(None)
+        for process in self.processes:
+            process.join(1.0)
+        self.connections = []
+        self.processes = []
+
+def shard_worker(connection, shared, capacity, shard, count, strip, seed):
+    # Run in each Shards process: apply the changes sent with a tick, tick the shard's members, write their snapshot
+    # and send back the members that flew into another shard's strip and the ones that left the world
+    rng = numpy.random.RandomState(seed)
+    snapshot = numpy.frombuffer(shared, dtype=numpy.int32).reshape(capacity, 4)
+    state = numpy.zeros((0, 9), dtype=numpy.int64) # slot, x, y, size, facing, then the position_limits rect
+    wings_up = numpy.zeros(0, dtype=bool)
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        removes, adds, places, selected, held = message
+        if len(removes) > 0:
+            keep = ~numpy.in1d(state[:,0], removes)
+            state = state[keep]
+            wings_up = wings_up[keep]
+        if len(adds) > 0:
+            rows = numpy.array(adds, dtype=numpy.int64) # slot, x, y, size, facing, wings_up, then position_limits
+            state = numpy.concatenate((state, rows[:, [0, 1, 2, 3, 4, 6, 7, 8, 9]]))
+            wings_up = numpy.concatenate((wings_up, rows[:, 5] != 0))
+        for slot, x, y in places:
+            at = numpy.flatnonzero(state[:,0] == slot)
+            state[at, 1] = x
+            state[at, 2] = y
+
+        slots = state[:,0]
+        is_selected = numpy.in1d(slots, selected)
+        is_held = is_selected | numpy.in1d(slots, held)
+        inside, moving, redraw = Swarm.step(rng, state[:,1], state[:,2], state[:,3], state[:,4], wings_up, state[:,5:9], is_selected, is_held)
+        flags = wings_up*Shards.WINGS_UP | inside*Shards.INSIDE | moving*Shards.MOVED | redraw*Shards.REDRAW
+        snapshot[slots] = numpy.stack((state[:,1], state[:,2], state[:,4], flags), axis=1)
+
+        gone = ~inside
+        left = inside & ((state[:,1]//strip) % count != shard)
+        connection.send((slots[left].tolist(), slots[gone].tolist()))
+        keep = ~(gone | left)
+        state = state[keep]
+        wings_up = wings_up[keep]
+
+class RenderQueue:
+    # What to draw this frame, as (surface, position) blits and draw functions, bucketed by layer. flush draws the
+    # layers bottom to top: each run of blits is culled against the viewport and drawn with a single Surface.blits,
+    # and functions (pygame.draw calls and the like) are called in between, in the order they were submitted
+    WORLD, SELECTED, TARGETED, EFFECTS, HUD = range(5)
+
+    def __init__(self):
+        self.layers = [[] for layer in xrange(self.HUD+1)] # [(surface, position) or (None, function)]
+
+    def submit(self, img, position, layer):
+        self.layers[layer].append((img, position))
+
+    def submit_many(self, pairs, layer):
+        self.layers[layer].extend(pairs)
+
+    def submit_draw(self, function, layer):
+        # function() draws straight onto the display and returns the rect it drew, or None
+        self.layers[layer].append((None, function))
+
+    def __len__(self):
+        return sum(len(commands) for commands in self.layers)
+
+    def flush(self, display):
+        viewport = display.surface.get_rect()
+        for commands in self.layers:
+            run = []
+            for img, target in commands:
+                if img is not None:
+                    run.append((img, target))
+                    continue
+                self.draw_run(display, viewport, run)
+                run = []
+                rect = target()
+                if rect is not None:
+                    display.mark(rect)
+            self.draw_run(display, viewport, run)
+            del commands[:]
+
+    def draw_run(self, display, viewport, run):
+        if len(run) == 0:
+            return
+        rects = [img.get_rect(topleft=position) for img, position in run]
+        visible = viewport.collidelistall(rects)
+        PROFILER.count("culled", len(run)-len(visible))
+        display.blits([(run[i][0], rects[i]) for i in visible])
+
+class Thing(object):
+    # Slots rather than a __dict__ per instance, as there can be a great many of these
+    __slots__ = ("_alive", "world", "name", "size", "_position", "colour_primary", "age", "_selected", "_targeted",
+                 "z", "swarm_slot")
+    physics = Physics()
+
+    def __init__(self, world, position, radius, name):
+        self.swarm_slot = None # Where this Thing lives in its World's Swarm, if it has one
+        self._alive = True
+        self.world = world
+        self.name = name
+        self.size = radius
+        # Not through the setter: things may be built off the main thread, and only join the world in add_element
+        self._position = position  # Co-ordinates within the world
+        self.colour_primary = None
+        self.age = 0
+
+        self._selected = False
+        self._targeted = False
+
+    # While a Thing is in a Swarm, the Swarm has the last word on where it is, and keeps copies of its flags
+
+    @property
+    def position(self):
+        if self.swarm_slot is None:
+            return self._position
+        return self.world.swarm.positions[self.swarm_slot]
+
+    @position.setter
+    def position(self, position):
+        self._position = position
+        self.world.element_moved(self) # Keep the world's spatial index up to date
+
+    @property
+    def alive(self):
+        return self._alive
+
+    @alive.setter
+    def alive(self, alive):
+        self._alive = alive
+        if self.swarm_slot is not None:
+            self.world.swarm.flag(self)
+
+    @property
+    def selected(self):
+        return self._selected
+
+    @selected.setter
+    def selected(self, selected):
+        self._selected = selected
+        if self.swarm_slot is not None:
+            self.world.swarm.flag(self)
+
+    @property
+    def targeted(self):
+        return self._targeted
+
+    @targeted.setter
+    def targeted(self, targeted):
+        self._targeted = targeted
+        if self.swarm_slot is not None:
+            self.world.swarm.flag(self)
+
+    def getColourPrimary(self):
+        if self.colour_primary is None:
+            self.colour_primary = Colour.random()
+        return self.colour_primary
+
+    def get_rect(self):
+        # Coordinates for the bounding box in the world
+        ox, oy = self.position
+        return (ox-self.size, oy-self.size, (self.size<<1), (self.size<<1))
+
+    def handle_event_click(self, pos):
+        click_x, click_y = pos
+
+        ox, oy, w, h = self.get_rect()
+
+        if ox <= click_x < ox+w and oy <= click_y < oy+h:
+            return True # Within bounds
+
+    def update(self):
+        self.age += 1
+
+    def release(self):
+        pass
+
+    def draw(self, display):
+        # Work out my position in the world, and how it maps onto the display
+        ox, oy = display.position
+
+        # Only draw this Thing if the Thing is within the display
+        bounds = self.get_rect()
+        #print bounds
+        # print "draw",bounds
+        if self.physics.check_collides((ox, oy, display.width, display.height), bounds):
+            # print "Drawing",self.name
+            minx, miny, w, h = bounds
+            pygame.draw.rect(display.surface, self.getColourPrimary(), (minx, miny, w, h))
+
+    def sprite(self, display):
+        return None # Drawn by draw() rather than as a single image
+
+    def draw_highlight(self, display, colour, layer=RenderQueue.HUD):
+        ox, oy = display.position
+
+        # Only draw this Thing if the Thing is within the display
+        bounds = self.get_rect()
+        #print "draw",bounds
+        if self.physics.check_collides((ox, oy, display.width, display.height), bounds):
+            #print "Drawing",self.name
+            minx, miny, w, h = bounds
+            display.submit_draw(functools.partial(pygame.draw.rect, display.surface, colour, (minx, miny, w, h), 2), layer)
+
+class Ornaments:
+    # Spots, eyespots and veins painted over a wing's pattern, inside the wing only. Each is worked out from a distance
+    # field over its own bounding box, rather than a pixel at a time. Specs use wing coordinates (x -1 to 1, y 0 to 1
+    # out from the body, as the outlines do) and sizes as a fraction of the wing, so they land the same at any radius.
+    # A spec is (kind, ...) and PAINTERS maps each kind to the function that paints it
+    @staticmethod
+    def generate(rng, main_wing, colour_count):
+        ornaments = []
+        for tip in rng.sample(main_wing, rng.randint(0, 5)): # Veins out from the body towards points of the outline
+            tx, ty = tip
+            ornaments.append(("vein", tx*0.05, ty*0.05, tx*0.85, ty*0.85, 0.012, 0))
+        for i in xrange(0, rng.randint(0, 6)):
+            tx, ty = rng.choice(main_wing)
+            t = rng.uniform(0.35, 0.8)
+            ornaments.append(("spot", tx*t, ty*t, rng.uniform(0.03, 0.08), rng.randint(0, colour_count-1)))
+        for i in xrange(0, rng.randint(0, 2)):
+            tx, ty = rng.choice(main_wing)
+            t = rng.uniform(0.45, 0.7)
+            ornaments.append(("eyespot", tx*t, ty*t, rng.uniform(0.08, 0.15), (0, rng.randint(0, colour_count-1), rng.randint(0, colour_count-1))))
+        return tuple(ornaments)
+
+    @staticmethod
+    def paint(img, ornaments, colours):
+        # Onto the lower half of a wing image, before it is mirrored
+        if len(ornaments) == 0:
+            return
+        if numpy is None:
+            Ornaments.paint_shapes(img, ornaments, colours)
+            return
+        layer = numpy.full(img.get_size(), -1, dtype=numpy.int16) # Colour index painted at each pixel, in spec order
+        half = img.get_width()>>1
+        for spec in ornaments:
+            for xs, ys, inside, colour in Ornaments.PAINTERS[spec[0]](spec, half, img.get_size()):
+                layer[xs, ys][inside] = colour
+        layer = layer[:, half:] # The wing is only drawn below the middle so far
+        alpha = pygame.surfarray.pixels_alpha(img)[:, half:]
+        painted = (layer >= 0) & (alpha != 0) # Inside the wing only
+        colour = numpy.array(colours, dtype=numpy.uint8)[layer[painted]]
+        rgb = pygame.surfarray.pixels3d(img)[:, half:]
+        rgb[painted] = colour[:, :3]
+        alpha[painted] = colour[:, 3]
+        del rgb, alpha # Unlock the surface
+
+    @staticmethod
+    def window(size, cx, cy, reach):
+        # Slices of the image within reach of (cx, cy), and the offset of each pixel in them from it
+        w, h = size
+        xs = slice(min(max(int(cx-reach), 0), w), min(max(int(cx+reach)+2, 0), w))
+        ys = slice(min(max(int(cy-reach), 0), h), min(max(int(cy+reach)+2, 0), h))
+        dx = numpy.arange(xs.start, xs.stop)[:, None] - cx
+        dy = numpy.arange(ys.start, ys.stop)[None, :] - cy
+        return xs, ys, dx, dy
+
+    @staticmethod
+    def paint_spot(spec, half, size):
+        kind, x, y, r, colour = spec
+        r *= half
+        xs, ys, dx, dy = Ornaments.window(size, half+x*half, half+y*half, r)
+        yield xs, ys, dx*dx+dy*dy <= r*r, colour
+
+    @staticmethod
+    def paint_eyespot(spec, half, size):
+        kind, x, y, r, colours = spec
+        r *= half
+        xs, ys, dx, dy = Ornaments.window(size, half+x*half, half+y*half, r)
+        d2 = dx*dx+dy*dy
+        for fraction, colour in zip((1.0, 0.65, 0.3), colours): # Outer ring to pupil
+            yield xs, ys, d2 <= (r*fraction)**2, colour
+
+    @staticmethod
+    def paint_vein(spec, half, size):
+        kind, x0, y0, x1, y1, width, colour = spec
+        ax, ay = half+x0*half, half+y0*half
+        vx, vy = (x1-x0)*half, (y1-y0)*half
+        reach = max(width*half, 0.6)
+        xs, ys, dx, dy = Ornaments.window(size, ax+vx*0.5, ay+vy*0.5, max(abs(vx), abs(vy))*0.5+reach)
+        dx = dx + vx*0.5 # Offsets from the start of the vein rather than its middle
+        dy = dy + vy*0.5
+        t = numpy.clip((dx*vx + dy*vy) / max(vx*vx + vy*vy, 1e-9), 0.0, 1.0) # Nearest point along the vein
+        ex = dx - t*vx
+        ey = dy - t*vy
+        yield xs, ys, ex*ex+ey*ey <= reach*reach, colour
+
+    @staticmethod
+    def paint_shapes(img, ornaments, colours):
+        # Without numpy: the same shapes drawn with pygame.draw on a layer, trimmed to the wing by its alpha.
+        # Edges can differ from the distance fields by a pixel
+        half = img.get_width()>>1
+        layer = pygame.Surface(img.get_size(), pygame.SRCALPHA)
+        for spec in ornaments:
+            if spec[0] == "vein":
+                kind, x0, y0, x1, y1, width, colour = spec
+                pygame.draw.line(layer, colours[colour], (half+x0*half, half+y0*half), (half+x1*half, half+y1*half), max(int(round(width*half*2)), 1))
+            else:
+                rings = ((1.0, spec[4]),) if spec[0] == "spot" else zip((1.0, 0.65, 0.3), spec[4])
+                for fraction, colour in rings:
+                    pygame.draw.circle(layer, colours[colour], (int(half+spec[1]*half), int(half+spec[2]*half)), max(int(spec[3]*half*fraction), 1))
+        wing = img.copy()
+        wing.fill((255, 255, 255, 0), special_flags=pygame.BLEND_RGBA_MAX) # White, with the wing's alpha
+        layer.blit(wing, (0, 0), special_flags=pygame.BLEND_RGBA_MIN)
+        img.blit(layer, (0, 0))
+
+Ornaments.PAINTERS = {
+    "spot": Ornaments.paint_spot,
+    "eyespot": Ornaments.paint_eyespot,
+    "vein": Ornaments.paint_vein,
+}
+
+class Genome:
+    # Everything that decides how a butterfly looks. Two butterflies with equal genomes have identical textures
+    def __init__(self, radius, main_offsets, sub_offsets, colours, pattern_scaler, pattern_offsets, ornaments=()):
+        self.radius = radius
+        self.main_offsets = main_offsets # Jitter applied to each point of the wing outlines
+        self.sub_offsets = sub_offsets
+        self.colours = colours
+        self.pattern_scaler = pattern_scaler
+        self.pattern_offsets = pattern_offsets # Centre of the pattern on the sub and main wing
+        self.ornaments = ornaments # Specs for Ornaments.paint
+        main, sub, self.body, self.antennae = Genome.create_geometry()
+        self.main_wing = Genome.jitter(main, main_offsets) # Body and antennae are the shared, unjittered outlines
+        self.sub_wing = Genome.jitter(sub, sub_offsets)
+        self.hashes = {} # quality: key
+
+    @staticmethod
+    def generate(rng):
+        icon_size = 64
+        radius = rng.randint(icon_size>>1,128)
+
+        main, sub, body, antennae = Genome.create_geometry()
+        jitter = 0.1
+        main_offsets = Genome.jitter_offsets(rng, len(main), jitter)
+        sub_offsets = Genome.jitter_offsets(rng, len(sub), jitter)
+
+        c = Colour()
+        colours = []
+        for i in xrange(0,rng.randint(3,21)):
+            if rng.randint(1,10) == 1:
+                keys = c.colours.keys()
+                colours.append(c.get(keys[rng.randint(0,len(keys)-1)], rng))
+            else:
+                colours.append(c.get("random"+str(i), rng))
+
+        pattern_scaler = 0.00001 + rng.random() * 0.01
+        pattern_offsets = ((rng.randint(-100,100), rng.randint(-100, 100)), (rng.randint(-100,100), rng.randint(-100, 100)))
+        # Ornaments get a generator of their own, seeded from everything above, so rng draws no more than it used to
+        fields = (radius, main_offsets, sub_offsets, tuple(colours), pattern_scaler, pattern_offsets)
+        ornament_rng = random.Random(int(hashlib.sha1(repr(fields).encode("ascii")).hexdigest()[:8], 16))
+        ornaments = Ornaments.generate(ornament_rng, Genome.jitter(main, main_offsets), len(colours))
+        return Genome(radius, main_offsets, sub_offsets, tuple(colours), pattern_scaler, pattern_offsets, ornaments)
+
+    FIELDS = ("radius", "main_offsets", "sub_offsets", "colours", "pattern_scaler", "pattern_offsets", "ornaments")
+
+    def to_dict(self):
+        # Plain values, e.g. for JSON. from_dict gives back an equal genome, with the same key
+        fields = dict((name, getattr(self, name)) for name in Genome.FIELDS)
+        fields["version"] = GENOME_VERSION
+        fields["key"] = self.key()
+        return fields
+
+    @staticmethod
+    def from_dict(fields):
+        def tuples(value): # JSON turns tuples into lists, and strings into unicode
+            if isinstance(value, list):
+                return tuple(tuples(v) for v in value)
+            if isinstance(value, unicode):
+                return str(value)
+            return value
+        return Genome(*[tuples(fields[name]) for name in Genome.FIELDS])
+
+    def key(self, quality=None):
+        # Content address for the textures drawn from this genome at a quality, the current TEXTURE_QUALITY by default
+        if quality is None:
+            quality = TEXTURE_QUALITY
+        if quality not in self.hashes:
+            fields = (GENOME_VERSION, self.radius, self.main_offsets, self.sub_offsets, self.colours, self.pattern_scaler, self.pattern_offsets,
+                      self.ornaments)
+            if quality != "full":
+                fields += (quality,)
+            self.hashes[quality] = hashlib.sha1(repr(fields).encode("ascii")).hexdigest()
+        return self.hashes[quality]
+
+    def lod_radius(self, quality=None):
+        radii = QUALITY_LEVELS[quality or TEXTURE_QUALITY][0]
+        if radii is None:
+            return self.radius
+        return radii[max(bisect.bisect_right(radii, self.radius) - 1, 0)]
+
+    def body_key(self):
+        # The body only depends on the size and two of the colours, so many genomes can share one
+        return (GENOME_VERSION, self.radius, self.colours[0], self.colours[2])
+
+    def render(self, texture_body=None, quality=None):
+        # Wings, body and the 64x64 icon used in the target bar. Pass a body with an equal body_key to reuse it
+        PROFILER.count("texture builds")
+        quality = quality or TEXTURE_QUALITY
+        icon_size = 64
+        lod = self.lod_radius(quality)
+        texture = self.plot_wing(lod)
+        if lod != self.radius:
+            scaler = QUALITY_LEVELS[quality][1]
+            texture = scaler(texture, (self.radius<<1, self.radius<<1))
+        if texture_body is None:
+            texture_body = self.plot_body()
+        icon = pygame.transform.scale(pygame.transform.rotate(self.plot_sample(texture, texture_body),90),(icon_size,icon_size))
+        return texture, texture_body, icon
+
+    def plot_sample(self, texture, texture_body):
+        sample = pygame.Surface((texture.get_width(),texture.get_height()),pygame.SRCALPHA)
+        sample.blit(texture_body,(0,0))
+        sample.blit(texture, (0, 0))
+        return sample
+
+    @staticmethod
+    def jitter_offsets(rng, count, amount):
+        result = []
+        for i in xrange(0, count):
+            x = (rng.random() * amount * float(rng.randint(-1, 1)))
+            y = (rng.random() * amount * float(rng.randint(-1, 1)))
+            result.append((x,y))
+        return tuple(result)
+
+    @staticmethod
+    def jitter(points, offsets):
+        result = []
+        for (x, y), (jx, jy) in zip(points, offsets):
+            x = x * 0.9
+            y = y * 0.9
+            x += jx
+            y += jy
+            # print x,y
+
+            # Clamp
+            if x > 1.0: x = 1.0
+            elif x < -1.0: x = -1.0
+            if y > 1.0: y = 1.0
+            elif y < 0.0: y = 0.0
+            result.append((x,y))
+
+        return tuple(result)
+
+    def plot_wing(self, radius=None):
+        # At another radius the pattern is stretched to match, so the wing looks the same at any size
+        if radius is None:
+            radius = self.radius
+        stretch = radius / float(self.radius)
+
+        w = h = radius<<1
+        cw = w>>1
+        ch = h>>1
+
+        img = pygame.Surface((w,h),pygame.SRCALPHA)
+        img1 = pygame.Surface((w, h), pygame.SRCALPHA)
+        img2 = pygame.Surface((w, h), pygame.SRCALPHA)
+
+        points = []
+        for px, py in self.sub_wing:
+            px = px*float(cw)+cw
+            py = py*float(ch)+ch
+            points.append((px, py)) # Scaled to the dimensions of the image, and offset from centre
+        pygame.draw.polygon(img1, self.colours[1], points, 0)
+        points_sub = points
+
+        points = []
+        for px, py in self.main_wing:
+            px = px*float(cw)+cw
+            py = py*float(ch)+ch
+            points.append((px, py)) # Scaled to the dimensions of the image, and offset from centre
+        pygame.draw.polygon(img2, self.colours[1], points, 0)
+        points_main = points
+
+        scaler = self.pattern_scaler
+        if radius != self.radius:
+            scaler = scaler / (stretch*stretch)
+        for img_wing, (offsetx, offsety) in ((img1, self.pattern_offsets[0]), (img2, self.pattern_offsets[1])):
+            if radius != self.radius:
+                offsetx, offsety = offsetx*stretch, offsety*stretch
+            self.plot_pattern(img_wing, offsetx, offsety, scaler)
+
+        pygame.draw.polygon(img1, self.colours[0], points_sub, 1)
+        pygame.draw.polygon(img2, self.colours[0], points_main, 1)
+        img.blit(img1, (0,0))
+        img.blit(img2, (0,0))
+
+        Ornaments.paint(img, self.ornaments, self.colours) # Spots and the rest, mirrored along with the wing below
+
+        img3 = pygame.transform.flip(img, False, True)
+
+        img.blit(img3, (0,0))
+
+        return img
+
+    def plot_pattern(self, img, offsetx, offsety, scaler):
+        # Colour the lower half of the wing wherever the wing shape has been drawn
+        if WING_PATTERN_ARRAYS:
+            self.plot_pattern_arrays(img, offsetx, offsety, scaler)
+        else:
+            self.plot_pattern_pixels(img, offsetx, offsety, scaler)
+
+    def plot_pattern_pixels(self, img, offsetx, offsety, scaler):
+        w = img.get_width()
+        cw = w>>1
+        ch = img.get_height()>>1
+        for x in xrange(0, w):
+            for y in xrange(ch, ch+(img.get_height()>>1)):
+                R,G,B,A = img.get_at((x,y))
+                if A is not 0:
+                    dx = x-cw+offsetx
+                    dy = y-ch+offsety
+                    val = abs(dx*dy*scaler)
+                    colhere = self.colours[(int(val)%(len(self.colours)-2))+1]
+                    img.set_at((x,y),colhere)
+
+    def plot_pattern_arrays(self, img, offsetx, offsety, scaler):
+        # Same banding as plot_pattern_pixels, worked out for every pixel at once
+        w = img.get_width()
+        cw = w>>1
+        ch = img.get_height()>>1
+        rows = slice(ch, ch+(img.get_height()>>1))
+
+        dx = numpy.arange(0, w) - cw + offsetx
+        dy = numpy.arange(rows.start, rows.stop) - ch + offsety
+        val = numpy.abs(numpy.outer(dx, dy) * scaler)
+        palette = numpy.array(self.colours, dtype=numpy.uint8)
+        colhere = palette[(val.astype(numpy.int64) % (len(self.colours)-2)) + 1]
+
+        alpha = pygame.surfarray.pixels_alpha(img)[:, rows]
+        mask = alpha != 0
+        rgb = pygame.surfarray.pixels3d(img)[:, rows]
+        rgb[mask] = colhere[mask][:, :3]
+        alpha[mask] = colhere[mask][:, 3]
+        del rgb, alpha  # Unlock the surface
+
+    def plot_body(self):
+        #
+
+        w = h = self.radius<<1
+        cw = w>>1
+        ch = h>>1
+
+        img = pygame.Surface((w,h),pygame.SRCALPHA)
+
+        points = []
+        for px, py in self.body:
+            px = px*float(cw)+cw
+            py = py*float(ch)+ch
+            points.append((px, py)) # Scaled to the dimensions of the image, and offset from centre
+        pygame.draw.polygon(img, self.colours[0], points, 0)
+
+        points = []
+        for px, py in self.antennae:
+            px = px*float(cw)+cw
+            py = py*float(ch)+ch
+            points.append((px, py)) # Scaled to the dimensions of the image, and offset from centre
+        pygame.draw.lines(img, self.colours[2], False, points)
+
+
+
+        img2 = pygame.transform.flip(img, False, True)
+
+        img.blit(img2, (0,0))
+
+        # pygame.image.save(img, "butterfly_left_side_body"+self.name+".png")
+        return img
+
+    # Main left wing, if oriented right along the 0 degrees line
+
+    MAIN_WING = (
+            (-0.2, 0.0), (0.2, 0.0), (0.9, 0.8), (1.0, 0.9), (0.9, 1.0), (0.2, 0.8),
+             (0.1, 0.7), (-0.2, 0.0)
+    )
+
+    # Sub left wing, if oriented right along the 0 degrees line
+
+    SUB_WING = (
+        (-0.02, 0.0), (0.05,0.6), (0.0, 0.8), (-0.3, 0.96), (-0.5, 0.9), (-0.8, 0.6),
+        (-1.0, 0.3), (-0.9, 0.2), (-0.02, 0.0)
+    )
+
+    # Body segments, if oriented right along the 0 degrees line
+    BODY = (
+        (0.4, 0.0), (0.38, 0.1), (-0.96, 0.06), (-1.9, 0.0), (0.4, 0.0)
+    )
+
+    ANTENNAE = (
+        (0.4, 0.05), (0.6, 0.2), (1.0, 0.4)
+    )
+
+    @staticmethod
+    def create_geometry():
+        # Shared tuples - every genome refers to the same outlines rather than a copy of its own
+        return Genome.MAIN_WING, Genome.SUB_WING, Genome.BODY, Genome.ANTENNAE
+
+
+class TextureCache:
+    # Rendered butterfly textures on disk, addressed by genome hash, so known butterflies are never rasterised twice.
+    # Kept under a budget (bytes, None for no limit) by deleting the least recently used genomes' files, oldest first.
+    # Only worth it when genomes come round again, e.g. spawning from a fixed range of seeds (--seeds)
+    def __init__(self, path, budget=64<<20):
+        self.path = path
+        self.budget = budget
+        self.parts = ("wing", "body", "icon")
+        self.lock = threading.Lock() # Fetched from the Spawner's threads
+        self.entries = collections.OrderedDict() # key: bytes on disk, least recently used first
+        self.used = 0
+        self.scan()
+
+    def scan(self):
+        # What is already on disk, oldest first by modification time (touched on every hit)
+        found = {}
+        if os.path.isdir(self.path):
+            for folder in os.listdir(self.path):
+                folder = os.path.join(self.path, folder)
+                if not os.path.isdir(folder):
+                    continue
+                for name in os.listdir(folder):
+                    key, _, part = name.rpartition("_")
+                    if key and part[:-4] in self.parts:
+                        stat = os.stat(os.path.join(folder, name))
+                        size, mtime = found.get(key, (0, 0))
+                        found[key] = (size + stat.st_size, max(mtime, stat.st_mtime))
+        for key in sorted(found, key=lambda key: found[key][1]):
+            self.entries[key] = found[key][0]
+            self.used += found[key][0]
+
+    def filename(self, genome, part, quality=None):
+        return self.key_filename(genome.key(quality), part)
+
+    def key_filename(self, key, part):
+        return os.path.join(self.path, key[:2], key+"_"+part+".png")
+
+    def fetch(self, genome, texture_body=None, quality=None):
+        key = genome.key(quality)
+        try:
+            textures = tuple(pygame.image.load(self.key_filename(key, part)) for part in self.parts)
+            with self.lock:
+                if key in self.entries:
+                    self.entries[key] = self.entries.pop(key) # Most recently used
+            os.utime(self.key_filename(key, self.parts[0]), None) # So the order survives a restart
+            return textures
+        except (pygame.error, IOError, OSError):
+            pass # Not cached yet, only partly written, or evicted
+        textures = genome.render(texture_body, quality)
+        save_sample(genome, textures, quality)
+        self.store(genome, textures, quality)
+        return textures
+
+    def store(self, genome, textures, quality=None):
+        key = genome.key(quality)
+        folder = os.path.dirname(self.key_filename(key, self.parts[0]))
+        try:
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+        except OSError:
+            pass # Another worker got there first
+        size = 0
+        for part, img in zip(self.parts, textures):
+            # Write then rename, so a reader never sees half a file
+            filename = self.key_filename(key, part)
+            partial = os.path.join(folder, str(os.getpid())+threading.current_thread().name+"_"+part+".png")
+            pygame.image.save(img, partial)
+            size += os.path.getsize(partial)
+            if os.path.exists(filename):
+                os.remove(partial)
+            else:
+                os.rename(partial, filename)
+        with self.lock:
+            self.used += size - self.entries.pop(key, 0)
+            self.entries[key] = size
+            evicted = []
+            while self.budget is not None and self.used > self.budget and len(self.entries) > 1:
+                old, old_size = self.entries.popitem(last=False)
+                self.used -= old_size
+                evicted.append(old)
+        for old in evicted:
+            for part in self.parts:
+                try:
+                    os.remove(self.key_filename(old, part))
+                except OSError:
+                    pass # Already gone
+
+def save_sample(genome, textures, quality=None):
+    # A picture of each newly rasterised butterfly, if SAMPLES_DIR exists
+    if SAMPLES_DIR is not None and os.path.exists(SAMPLES_DIR):
+        texture, texture_body, icon = textures
+        pygame.image.save(pygame.transform.rotate(genome.plot_sample(texture, texture_body),90), os.path.join(SAMPLES_DIR, "butterfly_"+genome.key(quality)+".png"))
+
+TEXTURE_CACHE = None # A TextureCache to keep rasterised butterflies on disk between sessions (--texture-cache)
+
+class TextureManager:
+    # Textures of the butterflies in play, interned so butterflies with equal genomes share one set, and genomes
+    # with equal body_keys share one body. Each is reference counted and let go as soon as the last butterfly
+    # using it leaves the world, along with its rotated frames. TEXTURE_CACHE saves drawing them again later
+    def __init__(self):
+        self.lock = threading.Lock() # Butterflies are built on the Spawner's threads
+        self.genomes = {} # genome key: [(wing, body, icon), references]
+        self.bodies = {} # body key: [body, references, body as drawn]. The drawn one is for the disk cache and render
+        self.buffer = None
+
+    def acquire(self, genome, quality=None):
+        # Textures at a quality, the current TEXTURE_QUALITY by default. Release them at the same quality
+        quality = quality or TEXTURE_QUALITY
+        key = genome.key(quality)
+        with self.lock:
+            entry = self.genomes.get(key)
+            if entry is not None:
+                entry[1] += 1
+                return entry[0]
+            body, references, known = self.bodies.get(genome.body_key(), (None, 0, None))
+        if TEXTURE_CACHE is not None:
+            textures = TEXTURE_CACHE.fetch(genome, known, quality)
+        else:
+            textures = genome.render(known, quality)
+            save_sample(genome, textures, quality)
+        texture, drawn_body, icon = textures
+        texture_body = body
+        if drawn_body is not known or body is None:
+            texture_body = display_format(drawn_body)
+        textures = display_format(texture), texture_body, display_format(icon)
+        with self.lock:
+            entry = self.genomes.get(key)
+            if entry is None: # Unless another thread got there first
+                texture, texture_body, icon = textures
+                shared = self.bodies.setdefault(genome.body_key(), [texture_body, 0, drawn_body])
+                shared[1] += 1
+                entry = self.genomes[key] = [(texture, shared[0], icon), 0]
+            entry[1] += 1
+            return entry[0]
+
+    def release(self, genome, quality=None):
+        key = genome.key(quality)
+        with self.lock:
+            entry = self.genomes.get(key)
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] > 0:
+                return
+            del self.genomes[key]
+            body_key = genome.body_key()
+            self.bodies[body_key][1] -= 1
+            if self.bodies[body_key][1] == 0:
+                del self.bodies[body_key]
+        if ROTATION_ATLAS is not None:
+            ROTATION_ATLAS.discard(key)
+
+    def scratch(self, size):
+        # One render buffer for every butterfly, grown to fit the largest so far. Main thread only
+        w, h = size
+        if self.buffer is None or self.buffer.get_width() < w or self.buffer.get_height() < h:
+            if self.buffer is not None:
+                w, h = max(w, self.buffer.get_width()), max(h, self.buffer.get_height())
+            self.buffer = display_format(pygame.Surface((w, h), pygame.SRCALPHA), "colorkey") # So rotate keeps the format
+        return self.buffer.subsurface((0, 0) + size)
+
+    def used(self):
+        # Bytes of texture held for live butterflies
+        with self.lock:
+            wings = sum(surface_bytes(wing) + surface_bytes(icon) for (wing, body, icon), references in self.genomes.values())
+            return wings + sum(surface_bytes(body) for body, references, drawn_body in self.bodies.values())
+
+TEXTURES = TextureManager()
+
+class Butterfly(Thing):
+    __slots__ = ("seed", "genome", "position_limits", "_facing", "_last_position", "texture", "texture_body", "icon",
+                 "_wings_up", "img_cache", "quality")
+
+    def __init__(self, display, name, position_limits, seed=None, spawn=True, genome=None):
+        # Everything about this butterfly comes from its own seeded generator, so it can be built on any thread.
+        # Pass a genome to respawn a known butterfly somewhere new
+        if seed is None:
+            seed = random.randint(0, MAX_SEED)
+        self.seed = seed
+        rng = random.Random(seed) # Only needed while building - its state is bigger than the rest of the butterfly
+        if genome is None:
+            genome = Genome.generate(rng)
+        self.genome = genome
+
+        position = rng.randint(0, display.surface.get_width()),rng.randint(display.surface.get_height()>>1, display.surface.get_height())
+        super(Butterfly,self).__init__(display.world, position, genome.radius, name)
+        self.position_limits = position_limits
+
+        # Animation hints
+        self.facing = rng.randint(0,359) # Initialise facing a random direction - Degrees
+        self.last_position = self.position # Where it was a tick ago, for drawing between ticks
+
+        self.quality = TEXTURE_QUALITY # Kept, as the governor may change TEXTURE_QUALITY while it is alive
+        self.texture, self.texture_body, self.icon = TEXTURES.acquire(genome, self.quality) # Shared with any others of this genome
+
+        self.wings_up = False
+
+        self.img_cache = None
+
+        if spawn:
+            display.world.add_element(self)
+
+    # Read from the Swarm while in one. Only update() sets them, and a Swarm member is never updated
+
+    @property
+    def facing(self):
+        if self.swarm_slot is None:
+            return self._facing
+        return self.world.swarm.facings[self.swarm_slot]
+
+    @facing.setter
+    def facing(self, facing):
+        self._facing = facing
+
+    @property
+    def wings_up(self):
+        if self.swarm_slot is None:
+            return self._wings_up
+        return self.world.swarm.wings[self.swarm_slot]
+
+    @wings_up.setter
+    def wings_up(self, wings_up):
+        self._wings_up = wings_up
+
+    @property
+    def last_position(self):
+        if self.swarm_slot is None:
+            return self._last_position
+        return self.world.swarm.last_positions[self.swarm_slot]
+
+    @last_position.setter
+    def last_position(self, last_position):
+        self._last_position = last_position
+
+    def draw_highlight(self, display, colour, layer=RenderQueue.HUD):
+        ox, oy = display.position
+
+        # Only draw this Thing if the Thing is within the display
+        bounds = self.get_rect()
+        #print "draw",bounds
+        if self.physics.check_collides((ox, oy, display.width, display.height), bounds):
+            #print "Drawing",self.name
+            minx, miny, w, h = bounds
+            # pygame.draw.rect(display.surface, colour, (minx, miny, w, h), 2)
+            display.submit_draw(functools.partial(pygame.draw.circle, display.surface, colour, (int(minx+(w>>1)), int(miny+(h>>1))), (w>>1), display.rng.randint(1,4)), layer)
+
+
+    def update(self):
+        self.age += 1
+        self.last_position = self.position
+
+        if self.physics.check_collides(self.position_limits, self.get_rect()):
+            x, y = self.position
+            delta = self.size>>4
+            if delta < 2:
+                delta = 2
+            if not self.selected:
+                x += random.randint(-delta, delta)
+                y += random.randint(-delta, delta)
+
+            self.position = x, y
+
+            if random.randint(1,40) == 1:
+                self.img_cache = None
+                if self.wings_up:
+                    self.wings_up = False
+                else:
+                    self.wings_up = True
+
+            if random.randint(1,10) == 1:
+                self.img_cache = None
+                self.facing = (self.facing + random.randint(-15,15))%360
+
+            if self.selected or self.targeted:
+                self.wings_up = False
+                self.img_cache = None
+
+        else:
+            self.alive = False # Offscreen... FOREVER!
+            self.targeted = False
+            self.selected = False
+            self.wings_up = False
+
+    def draw(self, display):
+        # Off screen butterflies are culled along with everything else when the render queue is flushed
+        img, position = self.sprite(display)
+        display.submit(img, position, display.layer_of(self))
+
+    def sprite(self, display):
+        # The image to draw this frame, and where its top left goes
+        # Draw the wings and the body
+        if ROTATION_ATLAS is not None:
+            angle = ROTATION_ATLAS.quantise(self.facing)
+            frame = (self.wings_up, angle)
+            final_img = ROTATION_ATLAS.get(self.genome.key(self.quality), frame) # Shared by every butterfly of this genome
+            if final_img is None:
+                final_img = self.render_frame(self.wings_up, angle)
+                ROTATION_ATLAS.put(self.genome.key(self.quality), frame, final_img)
+        else:
+            final_img = self.img_cache # Avoid rotation if we can
+            if final_img is None: # Rebuild the butterfly
+                final_img = self.render_frame(self.wings_up, self.facing)
+                self.img_cache = final_img
+
+        cw, ch = self.render_position(display.alpha)
+
+        minx = int(cw)-(final_img.get_width()>>1)
+        miny = int(ch)-(final_img.get_height()>>1)
+        return final_img, (minx, miny)
+
+    def render_position(self, alpha):
+        # Centre to draw at, part way from last tick's position to this one's
+        x, y = self.position
+        if alpha >= 1.0 or self.selected: # Held butterflies stay under the mouse
+            return x, y
+        lx, ly = self.last_position
+        return lx+(x-lx)*alpha, ly+(y-ly)*alpha
+
+    def render_frame(self, wings_up, angle):
+        # Work out what the plot locations of the creature are based on scales, transforms and rotations
+        PROFILER.count("rotations")
+        img_render_buffer = TEXTURES.scratch(self.texture.get_size())
+        w, h = img_render_buffer.get_size()
+        img_render_buffer.fill(img_render_buffer.get_colorkey() or (0,0,0,0)) # Transparent
+
+        img_render_buffer.blit(self.texture_body, (0,0)) # Body
+
+        wings = self.texture
+        offset = 0
+        if wings_up == True:
+            wings = pygame.transform.scale(self.texture, (w, h>>1))
+            offset = (h>>2)
+        img_render_buffer.blit(wings, (0, 0+offset)) # Wings
+
+        return pygame.transform.rotate(img_render_buffer, angle)
+
+    def release(self):
+        # Gone from the world - let go of the textures, and with the last of this genome its rotated frames
+        if self.texture is not None:
+            TEXTURES.release(self.genome, self.quality)
+            self.texture = self.texture_body = self.icon = self.img_cache = None
+
+class SurfaceCache:
+    # Surfaces kept in least recently used order, grouped by owner, and evicted once their pixels go over budget (bytes)
+    def __init__(self, budget):
+        self.budget = budget
+        self.used = 0
+        self.surfaces = collections.OrderedDict() # (owner, key): surface
+        self.owners = {} # owner: keys
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, owner, key):
+        surface = self.surfaces.pop((owner, key), None)
+        if surface is None:
+            self.misses += 1
+            return None
+        self.surfaces[(owner, key)] = surface # Now the most recently used
+        self.hits += 1
+        return surface
+
+    def put(self, owner, key, surface):
+        self.remove(owner, key)
+        self.surfaces[(owner, key)] = surface
+        self.owners.setdefault(owner, set()).add(key)
+        self.used += surface_bytes(surface)
+        while self.used > self.budget and len(self.surfaces) > 1:
+            oldest_owner, oldest_key = next(iter(self.surfaces))
+            self.remove(oldest_owner, oldest_key)
+
+    def remove(self, owner, key):
+        surface = self.surfaces.pop((owner, key), None)
+        if surface is not None:
+            self.used -= surface_bytes(surface)
+            keys = self.owners[owner]
+            keys.discard(key)
+            if len(keys) == 0:
+                del self.owners[owner]
+
+    def discard(self, owner):
+        for key in list(self.owners.get(owner, ())):
+            self.remove(owner, key)
+
+    def clear(self):
+        self.surfaces.clear()
+        self.owners.clear()
+        self.used = 0
+
+class RotationAtlas(SurfaceCache):
+    # Pre-rotated frames of each butterfly, wings up and down, at every 'step' degrees. Built as they are first needed
+    def __init__(self, step, budget):
+        SurfaceCache.__init__(self, budget)
+        self.step = step
+
+    def quantise(self, facing):
+        return (int(round(facing / float(self.step))) * self.step) % 360
+
+class ScaledSurfaces(SurfaceCache):
+    # Scaled copies of surfaces for animated grow and shrink transitions, kept under a budget (bytes). Frames that
+    # are not kept are scaled into one reused buffer per source instead, so an animation never allocates per frame
+    def __init__(self, budget):
+        SurfaceCache.__init__(self, budget)
+        self.buffers = {} # source: surface at least as big as any size asked of it
+
+    def scale(self, source, size, keep=False):
+        size = (max(1, int(size[0])), max(1, int(size[1])))
+        img = self.get(source, size)
+        if img is not None:
+            return img
+        PROFILER.count("scales")
+        if keep:
+            img = pygame.transform.scale(source, size)
+            self.put(source, size, img)
+        else:
+            img = pygame.transform.scale(source, size, self.buffer(source, size))
+        return img
+
+    def buffer(self, source, size):
+        # The returned subsurface shares its pixels with every other frame from this source: draw it before the next
+        buffer = self.buffers.get(source)
+        if buffer is None or buffer.get_width() < size[0] or buffer.get_height() < size[1]:
+            width, height = size
+            if buffer is not None:
+                width, height = max(width, buffer.get_width()), max(height, buffer.get_height())
+            buffer = pygame.transform.scale(source, (width, height)) # A surface in the same pixel format as source
+            self.buffers[source] = buffer
+        return buffer.subsurface((0, 0) + size)
+
+    def precompute(self, source, sizes):
+        # Keep the first frames of an animation, in order, for as long as they fit the budget
+        for size in sizes:
+            if self.used + size[0] * size[1] * source.get_bytesize() > self.budget:
+                break
+            self.scale(source, size, keep=True)
+
+    def discard(self, owner):
+        SurfaceCache.discard(self, owner)
+        self.buffers.pop(owner, None)
+
+class TextRenderer:
+    # Rendered strings kept in a SurfaceCache keyed by font, text and colour, so unchanged text never goes back
+    # to the font. Numbers are put together from a per font and colour atlas of digit glyphs instead
+    GLYPHS = "-0123456789"
+
+    def __init__(self, budget):
+        self.cache = SurfaceCache(budget)
+        self.glyphs = {} # (font, antialias, colour): {character: surface}
+
+    def render(self, font, text, antialias, colour):
+        key = (text, bool(antialias), tuple(colour))
+        img = self.cache.get(font, key)
+        if img is None:
+            PROFILER.count("font renders")
+            img = display_format(font.render(text, antialias, colour))
+            self.cache.put(font, key, img)
+        return img
+
+    def render_number(self, font, value, antialias, colour):
+        text = str(value)
+        key = (text, bool(antialias), tuple(colour), "glyphs")
+        img = self.cache.get(font, key)
+        if img is None:
+            glyphs = self.glyph_atlas(font, antialias, colour)
+            parts = [glyphs[c] for c in text]
+            img = pygame.Surface((sum(g.get_width() for g in parts), max(g.get_height() for g in parts)), pygame.SRCALPHA)
+            x = 0
+            for g in parts:
+                img.blit(g, (x, 0), special_flags=pygame.BLEND_RGBA_MAX) # A straight copy - glyphs never overlap
+                x += g.get_width()
+            img = display_format(img)
+            self.cache.put(font, key, img)
+        return img
+
+    def render_faded(self, font, text, antialias, colour, alpha):
+        # A copy of the rendered text to fade with surface alpha, rather than rendering each shade of it. It is shared,
+        # so blit it straight away; to queue it, use Display.submit_faded, which sets the alpha as it is drawn
+        key = (text, bool(antialias), tuple(colour), "faded")
+        img = self.cache.get(font, key)
+        if img is None:
+            img = self.render(font, text, antialias, colour).copy()
+            self.cache.put(font, key, img)
+        img.set_alpha(alpha)
+        return img
+
+    def glyph_atlas(self, font, antialias, colour):
+        key = (font, bool(antialias), tuple(colour))
+        glyphs = self.glyphs.get(key)
+        if glyphs is None:
+            glyphs = {}
+            for c in self.GLYPHS:
+                PROFILER.count("font renders")
+                glyphs[c] = font.render(c, antialias, colour)
+            self.glyphs[key] = glyphs
+        return glyphs
+
+class ParticlePool:
+    # Fixed capacity particles in parallel arrays, numpy ones when available. The live particles are always
+    # slots 0..count-1: a dead one is swap-removed by moving the last live particle into its slot.
+    # Each particle has a sprite and is drawn with its top left at (x, y) minus the sprite's offset
+    def __init__(self, capacity, gravity=0.01, cull_sides=True):
+        self.capacity = capacity
+        self.count = 0
+        self.gravity = gravity
+        self.cull_sides = cull_sides # False to only drop particles once they fall off the bottom
+        if numpy is not None:
+            self.x = numpy.zeros(capacity)
+            self.y = numpy.zeros(capacity)
+            self.dx = numpy.zeros(capacity)
+            self.dy = numpy.zeros(capacity)
+        else:
+            self.x = [0.0] * capacity
+            self.y = [0.0] * capacity
+            self.dx = [0.0] * capacity
+            self.dy = [0.0] * capacity
+        self.sprites = [None] * capacity # (surface, (offset x, offset y))
+
+    def emit(self, position, dx, dy, sprite, offset=(0, 0)):
+        if self.count >= self.capacity:
+            return False # Full - drop it rather than grow
+        i = self.count
+        self.x[i], self.y[i] = position
+        self.dx[i] = dx
+        self.dy[i] = dy
+        self.sprites[i] = (sprite, offset)
+        self.count += 1
+        return True
+
+    def update(self, width, height):
+        n = self.count
+        if n == 0:
+            return
+        if numpy is None:
+            return self.update_each(width, height)
+        x, y, dx, dy = self.x[:n], self.y[:n], self.dx[:n], self.dy[:n]
+        x += dx
+        y += dy
+        dy += self.gravity
+        alive = y < height
+        if self.cull_sides:
+            alive &= (x >= 0) & (x < width) & (y >= 0)
+        live = int(numpy.count_nonzero(alive))
+        if live == n:
+            return
+        # Swap-remove in one go: the holes among the first 'live' slots are filled from the survivors beyond them
+        holes = numpy.flatnonzero(~alive[:live])
+        movers = numpy.flatnonzero(alive[live:]) + live
+        for values in (self.x, self.y, self.dx, self.dy):
+            values[holes] = values[movers]
+        sprites = self.sprites
+        for hole, mover in zip(holes.tolist(), movers.tolist()):
+            sprites[hole] = sprites[mover]
+        sprites[live:n] = [None] * (n - live)
+        self.count = live
+
+    def update_each(self, width, height):
+        x, y, dx, dy, sprites = self.x, self.y, self.dx, self.dy, self.sprites
+        i = 0
+        while i < self.count:
+            x[i] += dx[i]
+            y[i] += dy[i]
+            dy[i] += self.gravity
+            if y[i] < height and (not self.cull_sides or (0 <= x[i] < width and y[i] >= 0)):
+                i += 1
+                continue
+            last = self.count - 1
+            x[i], y[i], dx[i], dy[i], sprites[i] = x[last], y[last], dx[last], dy[last], sprites[last]
+            sprites[last] = None
+            self.count = last
+
+    def blit_list(self):
+        # (surface, position) pairs for Display.blits
+        n = self.count
+        if numpy is not None:
+            xs, ys = self.x[:n].astype(numpy.int64).tolist(), self.y[:n].astype(numpy.int64).tolist()
+        else:
+            xs, ys = [int(v) for v in self.x[:n]], [int(v) for v in self.y[:n]]
+        return [(img, (px - ox, py - oy)) for (img, (ox, oy)), px, py in zip(self.sprites[:n], xs, ys)]
+
+def circle_sprite(radius, colour):
+    img = pygame.Surface((radius*2, radius*2), pygame.SRCALPHA)
+    pygame.draw.circle(img, colour, (radius, radius), radius, 0)
+    return display_format(img)
+
+def merge_rects(rects):
+    # Union overlapping rects until none overlap, so no area is drawn twice
+    merged = []
+    for rect in rects:
+        rect = pygame.Rect(rect)
+        overlapping = rect.collidelist(merged)
+        while overlapping != -1:
+            rect.union_ip(merged.pop(overlapping))
+            overlapping = rect.collidelist(merged)
+        merged.append(rect)
+    return merged
+
+def surface_bytes(surface):
+    return surface.get_width() * surface.get_height() * surface.get_bytesize()
+
+def surface_kind(surface):
+    # "opaque" if there is no transparency, "colorkey" if every pixel is either solid or fully transparent
+    # (butterflies, icons, particles), otherwise "alpha" (antialiased text, smoothscaled textures, the logo)
+    if surface.get_flags() & pygame.SRCALPHA == 0:
+        return "opaque" # Any colorkey is kept by convert()
+    solid = pygame.mask.from_surface(surface, 254)
+    if solid.count() == surface.get_width() * surface.get_height():
+        return "opaque"
+    if pygame.mask.from_surface(surface, 0).count() != solid.count():
+        return "alpha"
+    if solid.overlap_area(pygame.mask.from_threshold(surface, COLOURKEY, (1, 1, 1, 255)), (0, 0)) > 0:
+        return "alpha" # The key colour is in the picture
+    return "colorkey"
+
+def display_format(surface, kind=None):
+    # The surface in the display's pixel format, so blitting it never converts pixels on the way. kind is worked out
+    # by surface_kind unless given. Surfaces already in display format (rotated or scaled from one) come back as they are
+    if not DISPLAY_FORMAT or pygame.display.get_surface() is None:
+        return surface
+    if kind is None:
+        kind = surface_kind(surface)
+    if kind == "opaque":
+        return surface.convert()
+    if kind == "alpha":
+        return surface.convert_alpha()
+    keyed = pygame.Surface(surface.get_size()).convert()
+    keyed.fill(COLOURKEY)
+    keyed.blit(surface, (0, 0))
+    keyed.set_colorkey(COLOURKEY, pygame.RLEACCEL) # Runs of transparent pixels are skipped rather than tested
+    return keyed
+
+ROTATION_ATLAS = RotationAtlas(5, 64<<20) # Set to None to rotate each butterfly whenever it turns instead
+DISPLAY_FORMAT = True # Convert surfaces to the display's pixel format as they are made. False leaves them as drawn
+COLOURKEY = (255, 0, 255) # Transparent in colour keyed surfaces. No Colour.random colour has a channel under 128
+SCALED_SURFACES = ScaledSurfaces(8<<20)
+
+class Spawner:
+    # Builds new butterflies on worker threads. They only join the world once their textures are ready,
+    # and requests are turned away rather than queued when the workers are busy, so the frame loop never waits.
+    # seeds (first, last) draws new butterflies from that range, e.g. one generate.py has baked into the texture cache
+    def __init__(self, display, position_limits, workers=2, queue_size=8, seeds=None):
+        self.display = display
+        self.position_limits = position_limits
+        self.seeds = seeds
+        self.requests = Queue.Queue(queue_size)
+        self.ready = Queue.Queue()
+        self.pending = 0 # Requested but not yet in the world
+        self.workers = []
+        for i in xrange(0, workers):
+            worker = threading.Thread(target=self.work, name="Spawner"+str(i))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def request(self, name, seed=None):
+        if seed is None and self.seeds is not None:
+            seed = random.randrange(*self.seeds)
+        if seed is None:
+            seed = random.randint(0, MAX_SEED)
+        if len(self.workers) == 0: # No pool - build it now, in order
+            self.ready.put(self.build(name, seed))
+            self.pending += 1
+            return True
+        try:
+            self.requests.put_nowait((name, seed))
+        except Queue.Full:
+            return False
+        self.pending += 1
+        return True
+
+    def work(self):
+        while True:
+            name, seed = self.requests.get()
+            self.ready.put(self.build(name, seed))
+
+    def build(self, name, seed):
+        try:
+            return Butterfly(self.display, name, self.position_limits, seed, spawn=False)
+        except Exception:
+            traceback.print_exc()
+
+    def collect(self):
+        # Move finished butterflies into the world. Call once per frame from the main loop
+        while True:
+            try:
+                butterfly = self.ready.get_nowait()
+            except Queue.Empty:
+                break
+            self.pending -= 1
+            if butterfly is not None:
+                self.display.world.add_element(butterfly)
+
+class TargetTracker:
+    # The butterflies wanted in the target bar, in order, each with a fixed slot rect for its icon along the top.
+    # Only targets that moved (or died) since the last update, or whose slot moved, are tested against their slot,
+    # so the cost follows what changed rather than the number of targets
+    def __init__(self, world, top=2, gap=2):
+        self.world = world
+        world.track_changes()
+        self.top = top
+        self.gap = gap
+        self.targets = []
+        self.members = set()
+        self.slots = {} # target: (x, y, w, h)
+        self.pending = set() # Targets to test whether they moved or not
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __iter__(self):
+        return iter(self.targets)
+
+    def __contains__(self, target):
+        return target in self.members
+
+    def add(self, target):
+        if target in self.members or target.icon is None:
+            return False
+        self.targets.append(target)
+        self.members.add(target)
+        self.layout()
+        return True
+
+    def pop(self, index=0):
+        target = self.targets[index]
+        self.discard([target])
+        return target
+
+    def discard(self, targets):
+        targets = set(targets) & self.members
+        if len(targets) > 0:
+            self.targets = [t for t in self.targets if t not in targets]
+            self.members -= targets
+            self.pending -= targets
+            for t in targets:
+                del self.slots[t]
+            self.layout()
+
+    def layout(self):
+        # Icons side by side from the left. Any target whose slot moves gets tested again
+        x = self.gap
+        for t in self.targets:
+            slot = (x, self.top, t.icon.get_width(), t.icon.get_height())
+            if self.slots.get(t) != slot:
+                self.slots[t] = slot
+                self.pending.add(t)
+            x += self.gap + slot[2]
+
+    def update(self):
+        # Targets now over their slot, as (target, slot) in bar order. They leave the bar, as do dead ones
+        check = self.pending | (self.world.take_changed() & self.members)
+        self.pending = set()
+        matched = []
+        gone = []
+        for t in check:
+            if not t.alive or t.icon is None:
+                gone.append(t)
+            elif Physics.check_collides(self.slots[t], t.get_rect()):
+                matched.append((t, self.slots[t]))
+        matched.sort(key=lambda match: match[1][0])
+        self.discard(gone + [t for t, slot in matched])
+        return matched
+
+class Player:
+    def __init__(self):
+        self.score = 0
+        self.inventory = [ Jar(), Jar(), Jar(), Jar()]
+        self.stats = Statistics()
+        self.position = (0,0)
+        self.direction = 0
+        self.speed = 0
+
+    def add_score(self, score):
+        self.score += score
+
+    def draw(self, display):
+        ox, oy = display.position
+
+        # Only draw this Thing if the Thing is within the display
+        bounds = self.get_rect()
+        #print bounds
+        # print "draw",bounds
+        if self.physics.check_collides((ox, oy, display.width, display.height), bounds):
+            # print "Drawing",self.name
+            minx, miny, w, h = bounds
+            cw = w>>1
+            ch = h>>1
+
+
+class Jar(object):
+    __slots__ = ("contains", "uses", "colour")
+
+    def __init__(self):
+        self.contains = None
+        self.uses = 0
+        self.colour = PALETTE.get("black")
+
+    def place_in(self, thing):
+        # Replace the contents of the jar with the nominated thing
+        # If there was something in the jar to start with, returns that thing
+
+        result = self.contains
+        if self.contains is None:
+            self.contains = thing
+        self.uses += 1
+
+        return result
+
+    def draw(self, display, rect):
+        # Render this jar within the nominated rectangle
+        # ToDo: Replace with art asset
+
+        colour = self.colour
+
+class Display:
+    def __init__(self, world, size, position, headless=False):
+        self.age = 0
+        self.headless = headless # Offscreen surface, no window or sound card needed
+        self.show_profiler = False
+        self.profiler_font = None
+        self.alpha = 1.0 # How far between the last two ticks this frame is drawn
+        self.rng = random.Random() # For purely cosmetic randomness, so drawing never changes the game's random sequence
+        self.set_dirty_rects(False) # True to redraw and update only the parts of the screen that changed
+        self.text = TextRenderer(4<<20)
+        self.queue = RenderQueue()
+
+        self.world = world
+        self.size = size
+        self.width, self.height = self.size
+        self.position = position
+
+        self.initialised = False
+        self.surface = self.initialiseDisplay(self.world.get_description())
+        self.labelfont = None # Until load_fonts - text is left out until then
+        self.labelfontbig = None
+
+    def load_fonts(self):
+        # pygame's own font, so there is no need to look through the system's fonts first
+        labelfont = pygame.font.Font(None, 32)
+        self.labelfontbig = pygame.font.Font(None, 64)
+        self.labelfont = labelfont
+
+    def initialiseDisplay(self, description):
+        # print "Creating Surface and Window"
+        if self.headless:
+            os.environ["SDL_VIDEODRIVER"] = "dummy"
+            os.environ["SDL_AUDIODRIVER"] = "dummy"
+        pygame.init()
+        if not self.headless:
+            pygame.mixer.init()
+        surface = pygame.display.set_mode((self.width, self.height), pygame.SRCALPHA)
+        # Everything drawn on it is converted to its format as it is made - see display_format
+        # print "Changing the caption"
+        pygame.display.set_caption(description)
+        pygame.key.set_repeat(100) # Milliseconds before new key event issued
+        self.initialised = True
+        return surface
+
+    def blit(self, img, position):
+        PROFILER.count("blits")
+        self.mark(self.surface.blit(img, position))
+
+    def blits(self, pairs):
+        if len(pairs) == 0:
+            return
+        PROFILER.count("blits", len(pairs))
+        rects = self.surface.blits(pairs)
+        if self.dirty_rects:
+            self.overlay_rects.extend(rects)
+
+    def submit(self, img, position, layer=RenderQueue.HUD):
+        self.queue.submit(img, position, layer)
+
+    def submit_many(self, pairs, layer=RenderQueue.EFFECTS):
+        self.queue.submit_many(pairs, layer)
+
+    def submit_draw(self, function, layer=RenderQueue.HUD):
+        self.queue.submit_draw(function, layer)
+
+    def submit_faded(self, img, position, alpha, layer=RenderQueue.EFFECTS):
+        # img at this alpha, set when it is drawn, so one surface queued at several alphas in a frame draws each right
+        self.queue.submit_draw(functools.partial(self.blit_faded, img, position, alpha), layer)
+
+    def blit_faded(self, img, position, alpha):
+        PROFILER.count("blits")
+        img.set_alpha(alpha)
+        return self.surface.blit(img, position)
+
+    def flush(self):
+        # Draw everything submitted this frame
+        self.queue.flush(self)
+
+    def layer_of(self, element):
+        # Held butterflies go over everything else in the world
+        if getattr(element, "selected", False):
+            return RenderQueue.SELECTED
+        return RenderQueue.WORLD
+
+    def mark(self, rect):
+        # Note a rect drawn over the world this frame, so the dirty rect renderer can put it back next frame
+        if self.dirty_rects:
+            self.overlay_rects.append(rect)
+
+    def render_text(self, font, text, antialias, colour):
+        return self.text.render(font, text, antialias, colour)
+
+    def render_number(self, font, value, antialias, colour):
+        return self.text.render_number(font, value, antialias, colour)
+
+    def draw_profiler(self):
+        # Overlay of the last frames' timings (ms, p50/p99) and counters (per frame, p50/max)
+        if self.profiler_font is None:
+            self.profiler_font = pygame.font.Font(None, 18)
+        y = 70
+        for line in PROFILER.report():
+            img = self.profiler_font.render(line, 1, (255, 255, 255), (0, 0, 0))
+            self.blit(img, (2, y))
+            y += img.get_height()
+
+    def draw(self):
+        if self.dirty_rects:
+            return self.draw_dirty()
+        self.surface.fill(self.world.colour_background)
+        ox, oy = self.position
+        for e in self.world.query_rect((ox, oy, self.width, self.height)):
+            sprite = e.sprite(self)
+            if sprite is None:
+                self.submit_draw(functools.partial(e.draw, self), self.layer_of(e))
+            else:
+                self.queue.submit(sprite[0], sprite[1], self.layer_of(e))
+
+    def draw_dirty(self):
+        # Only put back what changed: wherever an element moved, turned or came and went, and wherever
+        # last frame's overlays (HUD, particles, text...) were drawn. Everything else stays on screen as it is
+        ox, oy = self.position
+        screen = pygame.Rect(ox, oy, self.width, self.height)
+        dirty = self.last_overlay_rects
+        sprites = {}
+        for e in self.world.query_rect((ox, oy, self.width, self.height)):
+            sprite = e.sprite(self)
+            if sprite is None:
+                img, rect = None, pygame.Rect(e.get_rect())
+            else:
+                img, position = sprite
+                rect = img.get_rect(topleft=position)
+            sprites[e] = (img, rect)
+            last = self.last_sprites.pop(e, None)
+            if last is None:
+                dirty.append(rect)
+            elif last[0] is not img or last[1] != rect:
+                dirty.append(rect)
+                dirty.append(last[1])
+        for img, rect in self.last_sprites.values(): # Gone
+            dirty.append(rect)
+        self.last_sprites = sprites
+
+        if self.full_redraw:
+            dirty = [screen]
+            self.full_redraw = False
+        dirty = merge_rects([r.clip(screen) for r in dirty if r.colliderect(screen)])
+
+        order = sorted(sprites.items(), key=lambda item: (self.layer_of(item[0]), item[0].z))
+        for area in dirty:
+            self.surface.set_clip(area)
+            self.surface.fill(self.world.colour_background, area)
+            for e, (img, rect) in order:
+                if rect.colliderect(area):
+                    if img is None:
+                        e.draw(self)
+                    else:
+                        PROFILER.count("blits")
+                        self.surface.blit(img, rect)
+        self.surface.set_clip(None)
+        self.frame_rects = dirty
+        self.overlay_rects = []
+        self.last_overlay_rects = []
+
+    def update(self):
+        self.flip()
+        return self.get_events()
+
+    def flip(self):
+        if self.dirty_rects and self.frame_rects is not None:
+            rects = self.frame_rects + self.overlay_rects
+            PROFILER.count("dirty rects", len(rects))
+            PROFILER.count("dirty pixels", sum(r.width*r.height for r in rects))
+            pygame.display.update(rects)
+            self.last_overlay_rects = self.overlay_rects
+            self.overlay_rects = []
+            self.frame_rects = None
+        else:
+            pygame.display.update()
+
+    def set_dirty_rects(self, enabled):
+        self.dirty_rects = enabled
+        self.full_redraw = True
+        self.last_sprites = {}
+        self.overlay_rects = []
+        self.last_overlay_rects = []
+        self.frame_rects = None
+
+    def get_events(self):
+        self.age += 1
+        unhandledEvents = []
+        events = pygame.event.get()
+        for event in events:
+            if event.type == pygame.MOUSEBUTTONUP:
+                # Clicked on a UI element?
+                unhandledEvents.append(event)
+            elif event.type == pygame.MOUSEBUTTONDOWN:
+                if event.button == 4:  # Scroll
+                    unhandledEvents.append(event)
+                if event.button == 5:  # Scroll
+                    unhandledEvents.append(event)
+                else:
+                    unhandledEvents.append(event)
+
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_F3: # Profiler overlay
+                    unhandledEvents.append(event)
+                elif event.key == pygame.K_MINUS or event.key == pygame.K_KP_MINUS:
+                    unhandledEvents.append(event)
+                elif event.key == pygame.K_PLUS or event.key == pygame.K_KP_PLUS or event.key == pygame.K_EQUALS:
+                    unhandledEvents.append(event)
+
+            else:
+                unhandledEvents.append(event)
+
+        return unhandledEvents
+
+class Statistics:
+    def __init__(self):
+        self.select_fail = 0
+        self.select_success = 0
+
+class Tools(object):
+    __slots__ = ("rect", "name", "alive", "colour_background", "colour_border", "z", "swarm_slot")
+
+    def __init__(self, display, name, rect):
+        self.rect = rect
+        # print self.rect
+        self.name = name
+        self.alive = True
+        self.swarm_slot = None
+        self.colour_background = PALETTE.get("brown")
+        self.colour_border = PALETTE.get("black")
+        display.world.add_element(self)
+
+    def get_height(self):
+        x,y,w,h = self.rect
+        return h
+
+    def get_rect(self):
+        return self.rect
+
+    def update(self):
+        pass
+
+    def release(self):
+        pass
+
+    def draw(self, display):
+        display.surface.fill(self.colour_background,self.rect)
+        pygame.draw.rect(display.surface, self.colour_border, self.rect, 2)
+
+    def sprite(self, display):
+        return None
+
+    def handle_event_click(self, pos):
+        click_x, click_y = pos
+
+        ox, oy, w, h = self.rect
+
+        if ox <= click_x < ox+w and oy <= click_y < oy+h:
+            return True # Within bounds
+
+    def draw_highlight(self, display, colour, layer=RenderQueue.HUD):
+        pass
+
+class Loader:
+    # Startup work in named stages, run one after another on a background thread so the first frame doesn't wait.
+    # With threaded False they all run straight away instead, e.g. for headless runs that have to be repeatable
+    def __init__(self, stages, threaded=True):
+        self.stages = stages # [(name, function)]
+        self.done = 0
+        self.current = None
+        if threaded:
+            thread = threading.Thread(target=self.run, name="Loader")
+            thread.daemon = True
+            thread.start()
+        else:
+            self.run()
+
+    def run(self):
+        for name, stage in self.stages:
+            self.current = name
+            try:
+                stage()
+            except Exception:
+                traceback.print_exc() # Carry on without it
+            self.done += 1
+        self.current = None
+
+    def finished(self):
+        return self.done == len(self.stages)
+
+class Replay:
+    # A session as its seed, the settings that shape its world and the mouse events handled at each tick. Saved as a
+    # header of magic, version, seed, initial population (-1 for a random one), butterfly cap, shard count, swarm
+    # (1 or 0) and the range butterfly seeds are drawn from (0, 0 for any), then one fixed size record per event:
+    # tick, kind, x, y, rel x, rel y, button (or buttons held as bits)
+    MAGIC = b"BFRP"
+    VERSION = 4
+    HEADER = struct.Struct("<4sHIiIHBII")
+    EVENT = struct.Struct("<IBhhhhB")
+    END = 0 # Record marking the tick the session stopped at
+    KINDS = {pygame.MOUSEBUTTONDOWN: 1, pygame.MOUSEBUTTONUP: 2, pygame.MOUSEMOTION: 3}
+
+    def __init__(self, seed, population=None, max_items=30, shards=0, swarm=False, seeds=None):
+        self.seed = seed
+        self.population = population
+        self.max_items = max_items
+        self.shards = shards
+        self.swarm = swarm
+        self.seeds = seeds
+        self.events = {} # tick: [event]
+        self.ticks = 0
+
+    def record(self, tick, event):
+        if event.type in self.KINDS:
+            self.events.setdefault(tick, []).append(event)
+        self.ticks = max(self.ticks, tick)
+
+    def script(self):
+        # The events in the form Game takes as a script
+        return self.events
+
+    def save(self, filename):
+        with open(filename, "wb") as f:
+            population = -1 if self.population is None else self.population
+            first, last = (0, 0) if self.seeds is None else self.seeds
+            f.write(self.HEADER.pack(self.MAGIC, self.VERSION, self.seed, population, self.max_items, self.shards, int(self.swarm),
+                                     first, last))
+            for tick in sorted(self.events):
+                for event in self.events[tick]:
+                    kind = self.KINDS[event.type]
+                    x, y = event.pos
+                    if event.type == pygame.MOUSEMOTION:
+                        rx, ry = event.rel
+                        button = sum(1<<i for i, held in enumerate(event.buttons) if held)
+                    else:
+                        rx = ry = 0
+                        button = event.button
+                    f.write(self.EVENT.pack(tick, kind, x, y, rx, ry, button))
+            f.write(self.EVENT.pack(self.ticks, self.END, 0, 0, 0, 0, 0))
+
+    @staticmethod
+    def load(filename):
+        with open(filename, "rb") as f:
+            data = f.read()
+        magic, version = struct.unpack_from("<4sH", data, 0)
+        if magic != Replay.MAGIC or version != Replay.VERSION:
+            raise ValueError("%s is not a version %d replay" % (filename, Replay.VERSION))
+        magic, version, seed, population, max_items, shards, swarm, first, last = Replay.HEADER.unpack_from(data, 0)
+        replay = Replay(seed, None if population < 0 else population, max_items, shards, swarm != 0,
+                        None if first == last else (first, last))
+        types = dict((kind, event_type) for event_type, kind in Replay.KINDS.items())
+        for offset in xrange(Replay.HEADER.size, len(data), Replay.EVENT.size):
+            tick, kind, x, y, rx, ry, button = Replay.EVENT.unpack_from(data, offset)
+            if kind == Replay.END:
+                replay.ticks = tick
+            elif types[kind] == pygame.MOUSEMOTION:
+                buttons = tuple(1 if button & (1<<i) else 0 for i in xrange(0, 3))
+                replay.record(tick, pygame.event.Event(pygame.MOUSEMOTION, pos=(x, y), rel=(rx, ry), buttons=buttons))
+            else:
+                replay.record(tick, pygame.event.Event(types[kind], pos=(x, y), button=button))
+        return replay
+
+class Governor:
+    # Holds the frame time to a target by trading population and effects for speed, a tier at a time. It watches
+    # the slowest frames (90th percentile) of each window: one window over the target steps down a tier, but it only
+    # steps back up after several windows in a row well under it, and waits a few windows after any change, so it
+    # settles rather than flapping between two tiers. Disabled, it stays on the first tier and changes nothing
+    TIERS = [
+        # Fractions of the level's population, spawn rate and particles, degrees between rotated frames, texture detail
+        {"population": 1.0, "spawn": 1.0, "particles": 1.0, "rotation_step": 5, "texture_quality": "full"},
+        {"population": 0.75, "spawn": 0.75, "particles": 0.5, "rotation_step": 10, "texture_quality": "full"},
+        {"population": 0.5, "spawn": 0.5, "particles": 0.25, "rotation_step": 15, "texture_quality": "lod"},
+        {"population": 0.3, "spawn": 0.25, "particles": 0.1, "rotation_step": 30, "texture_quality": "low"},
+    ]
+
+    def __init__(self, target, enabled=True, window=60, headroom=0.7, calm_windows=5, cooldown_windows=2):
+        self.target = target # Milliseconds of work a frame
+        self.enabled = enabled
+        self.window = window # Frames
+        self.headroom = headroom # Under this fraction of the target counts as room to spare
+        self.calm_windows = calm_windows
+        self.cooldown_windows = cooldown_windows
+        self.samples = []
+        self.level = 0 # Index into TIERS
+        self.calm = 0 # Windows in a row with room to spare
+        self.cooldown = 0
+        self.quality = TEXTURE_QUALITY # As chosen with --quality. The governor never draws better than this
+        self.step = ROTATION_ATLAS.step if ROTATION_ATLAS is not None else None
+
+    def tier(self):
+        return Governor.TIERS[self.level]
+
+    def sample(self, milliseconds):
+        # One frame's work. True when it changed tier
+        if not self.enabled:
+            return False
+        self.samples.append(milliseconds)
+        if len(self.samples) < self.window:
+            return False
+        samples = sorted(self.samples)
+        self.samples = []
+        slow = samples[int(len(samples) * 0.9)]
+        if self.cooldown > 0:
+            self.cooldown -= 1
+            return False
+        if slow > self.target:
+            return self.shift(1)
+        if slow < self.target * self.headroom:
+            self.calm += 1
+            if self.calm >= self.calm_windows:
+                return self.shift(-1)
+        else:
+            self.calm = 0
+        return False
+
+    def shift(self, direction):
+        level = min(max(self.level + direction, 0), len(Governor.TIERS) - 1)
+        self.calm = 0
+        if level == self.level:
+            return False
+        self.level = level
+        self.cooldown = self.cooldown_windows
+        self.apply()
+        PROFILER.count("quality changes")
+        return True
+
+    def apply(self):
+        # Butterflies keep the textures they were made with; only new ones pick up a new TEXTURE_QUALITY.
+        # Every rotation step is a multiple of the first, so frames already in the atlas are reused
+        global TEXTURE_QUALITY
+        tier = self.tier()
+        if ROTATION_ATLAS is not None:
+            ROTATION_ATLAS.step = max(self.step, tier["rotation_step"])
+        qualities = list(QUALITY_LEVELS)
+        TEXTURE_QUALITY = qualities[max(qualities.index(self.quality), qualities.index(tier["texture_quality"]))]
+
+    def restore(self):
+        # Back to the first tier, e.g. on the way out
+        self.level = 0
+        self.apply()
+
+class Game:
+    # One session of play. Simulation and drawing are split into phases, so they can be paced and timed separately
+    def __init__(self, display, seed=None, workers=2, population=None, max_items=30, script=None, interpolate=True, replay=None,
+                 govern=False, seeds=None):
+        # govern lets the Governor scale the level's settings down to hold the frame rate. Off, runs are repeatable.
+        # seeds (first, last) limits new butterflies to that range of seeds
+        self.level = 0
+        self.levels =   {
+                            "1": {
+                                "butterflies_max": max_items,
+                                "spawn_chance": 100, # A butterfly is asked for on one tick in this many, while there is room
+                                "particles": (5, 15), # Burst when a target is matched
+                                "flutter": False,
+                                "timer_max": 8000, # Ticks to the next level
+
+                            },
+
+                        }
+
+        if seed is not None:
+            random.seed(seed)
+            display.rng.seed(seed) # Highlight flicker too, so seeded frames and replay snapshots come out the same
+        self.display = display
+        self.logo_img = None # Until load_logo
+        self.logo = None
+        self.logo_shrink = 0
+        self.ui_colours = PALETTE
+
+        self.display_world_region = (0,0,display.surface.get_width(),display.surface.get_height())
+
+        self.player = Player()
+
+        self.instructions_done = False
+
+        self.particles = ParticlePool(4096)
+        self.scoreticles = ParticlePool(256, cull_sides=False)
+        self.particle_sprites = [circle_sprite(radius, (255, 255, 255, 255)) for radius in xrange(2, 6)]
+        self.selected = None
+        self.targeted = None
+        self.running = True
+        self.iterationCount = 0
+
+        self.started = time.time()
+        self.loaded = None # Seconds from started until fonts, logo, music and the initial population were all in
+        self.loader = Loader([
+            ("fonts", display.load_fonts),
+            ("logo", self.load_logo),
+            ("music", self.load_music),
+        ], threaded=workers > 0)
+        self.spawner = Spawner(display, self.display_world_region, workers, seeds=seeds)
+        self.initial_population = population
+        if population is None:
+            self.initial_population = random.randint(10,50)
+        self.initial_spawned = 0
+        self.fadeText = []
+        self.targets = TargetTracker(display.world)
+        self.mousepos = -999,-999 # Default
+        self.script = script # Extra events to feed in, keyed by iteration
+        self.replay = replay # Replay to record the handled events into
+
+        self.simulation_phases = [
+            ("spawn", self.spawn),
+            ("tick", self.tick),
+            ("targets", self.match_targets),
+            ("effects", self.update_effects),
+        ]
+        self.render_phases = [
+            ("draw", self.draw),
+            ("targets", self.draw_targets),
+            ("text", self.draw_fade_text),
+            ("particles", self.draw_particles),
+            ("hud", self.draw_hud),
+            ("flush", self.display.flush),
+        ]
+
+        # Frame pacing. The simulation always advances in whole ticks of 1/tick_rate seconds, whatever the frame rate
+        self.tick_rate = 120
+        self.max_fps = 60
+        self.max_catchup_ticks = 5 # Ticks per frame before we start skipping frames to catch up
+        self.max_frame_skip = 2 # Frames in a row we may skip. Beyond that the game slows down instead
+        self.interpolate = interpolate # Draw butterflies part way between ticks
+        self.clock = pygame.time.Clock()
+        self.accumulator = 0.0
+        self.frames_skipped = 0
+        self.governor = Governor(1000.0 / self.max_fps, govern)
+
+    def load_logo(self):
+        if os.path.exists("WF4_t_w.png"):
+            logo_img = display_format(pygame.image.load("WF4_t_w.png"))
+            self.logo_max_shrink = logo_img.get_width()>>1
+            SCALED_SURFACES.precompute(logo_img, self.logo_sizes(logo_img))
+            self.logo = logo_img
+            self.logo_img = logo_img
+
+    def logo_sizes(self, logo_img):
+        # The shrink animation's keyframes, one a tick once it starts
+        return [(logo_img.get_width()-shrink, logo_img.get_height()-shrink) for shrink in xrange(self.logo_max_shrink)]
+
+    def load_music(self):
+        if not self.display.headless:
+            pygame.mixer_music.load("abmusic.mp3")
+            pygame.mixer_music.play(-1)
+
+    def loading_progress(self):
+        # 0 to 1 across the loader's stages and the initial population, with the population as one more stage
+        population = min(len(self.display.world.get_elements()), self.initial_population) / float(max(self.initial_population, 1))
+        return (self.loader.done + population) / float(len(self.loader.stages) + 1)
+
+    def get_level(self, level):
+        # Levels past the last one defined play like it
+        return self.levels.get(str(level)) or self.levels[max(self.levels, key=int)]
+
+    def settings(self):
+        # The current level, scaled by the governor's tier. Difficulty and performance are both decided here
+        level = self.get_level(self.level)
+        tier = self.governor.tier()
+        settings = dict(level)
+        settings["butterflies_max"] = max(1, int(level["butterflies_max"] * tier["population"]))
+        settings["spawn_chance"] = max(1, int(level["spawn_chance"] / tier["spawn"]))
+        settings["particles_max"] = int(self.particles.capacity * tier["particles"])
+        return settings
+
+    def step(self):
+        # Exactly one tick and one frame, no pacing - for headless runs and benchmarks
+        self.handle_events()
+        self.simulate()
+        self.render(1.0)
+        PROFILER.end_frame()
+        return self.running
+
+    def run_frame(self):
+        # As many ticks as the time since the last frame calls for, then at most one frame. The clock caps the frame rate
+        self.handle_events()
+        dt = 1.0 / self.tick_rate
+        backlog = dt * self.max_catchup_ticks * (self.max_frame_skip + 1)
+        self.accumulator = min(self.accumulator + self.clock.tick(self.max_fps) / 1000.0, backlog)
+        self.governor.sample(self.clock.get_rawtime()) # Time spent on the last frame, not counting the wait
+
+        ticks = 0
+        while self.accumulator >= dt and ticks < self.max_catchup_ticks:
+            self.simulate()
+            self.accumulator -= dt
+            ticks += 1
+
+        if self.accumulator >= dt and self.frames_skipped < self.max_frame_skip:
+            self.frames_skipped += 1 # Still behind - spend the next frame simulating too
+            PROFILER.count("frames skipped")
+        else:
+            self.frames_skipped = 0
+            alpha = 1.0
+            if self.interpolate:
+                alpha = min(self.accumulator / dt, 1.0)
+            self.render(alpha)
+        PROFILER.end_frame()
+        return self.running
+
+    def simulate(self):
+        for name, phase in self.simulation_phases:
+            PROFILER.start(name)
+            phase()
+            PROFILER.stop(name)
+
+    def render(self, alpha):
+        self.display.alpha = alpha
+        for name, phase in self.render_phases:
+            PROFILER.start(name)
+            phase()
+            PROFILER.stop(name)
+        if self.loaded is None:
+            self.draw_loading()
+        if self.display.show_profiler:
+            self.display.draw_profiler()
+        self.display.flip()
+
+    def spawn(self):
+        display = self.display
+        settings = self.settings()
+        if self.iterationCount%settings["timer_max"] == 0:
+            self.level += 1
+            self.fadeText.append(("LEVEL "+str(self.level),255))
+        if self.logo_img is not None and self.iterationCount > 300 and self.logo_shrink < self.logo_max_shrink:
+            self.logo = SCALED_SURFACES.scale(self.logo_img,(self.logo_img.get_width()-self.logo_shrink, self.logo_img.get_height()-self.logo_shrink))
+            self.logo_shrink += 1
+            if self.logo_shrink == self.logo_max_shrink:
+                self.logo = self.logo.copy() # The last frame stays up; let the animation's frames go
+                SCALED_SURFACES.discard(self.logo_img)
+        #if iterationCount % 10000 == 0:
+        #    print "Number of elements",len(display.world.elements)
+
+        self.iterationCount += 1
+
+        potentials = display.world.get_elements()
+        if self.iterationCount %500 == 0:
+            if random.randint(1, 10) == 1 and len(self.targets) > 0:
+                self.targets.pop(0)
+            if len(potentials) > 0:
+                potential = potentials[random.randint(0, len(potentials) - 1)]
+                if potential.alive:
+                    self.targets.add(potential)  # Add a new target, unless it already is one
+
+        while self.initial_spawned < self.initial_population and self.spawner.request("Thing"+str(self.initial_spawned)):
+            self.initial_spawned += 1
+        if self.governor.level > 0 and self.iterationCount % self.tick_rate == 0 and len(potentials) > settings["butterflies_max"]:
+            self.retire(potentials)
+        if len(potentials) + self.spawner.pending < settings["butterflies_max"]:
+            if random.randint(1,settings["spawn_chance"]) == 1:
+                self.spawner.request("Butterfly")
+        self.spawner.collect()
+
+    def retire(self, potentials):
+        # Over the governor's cap: one butterfly the player isn't holding or hunting flies off, once a second
+        for potential in potentials:
+            if potential.alive and potential is not self.selected and potential not in self.targets:
+                potential.alive = False
+                return
+
+    def tick(self):
+        # Tick the world
+        # print "Ticking",len(display.world.elements)
+        self.display.world.tick()
+
+    def draw(self):
+        display = self.display
+        # Draw the world
+        #print "Drawing",len(display.world.elements)
+        # Object rendering
+        display.draw()
+        # Special UI hints to the player
+        if self.selected is not None and self.selected.alive:
+            self.selected.draw_highlight(display, (136, 255, 242, display.rng.randint(30,170)), RenderQueue.SELECTED)  # Red
+        if self.targeted is not None and self.targeted.alive:
+            self.targeted.draw_highlight(display, self.ui_colours.get("green"), RenderQueue.TARGETED)  # Green
+
+    def match_targets(self):
+        display = self.display
+        settings = self.settings()
+        remaining = len(self.targets)
+        for s, (slot_x, slot_y, slot_w, slot_h) in self.targets.update():
+            # print "Matched!"
+            score = s.size*10
+            centre_pos = (slot_x+(slot_w>>1),(slot_h>>1))
+            if remaining == 1:
+                # score += player.score
+                score += score*(self.level+1)
+                if display.labelfont is not None:
+                    score_img = display.render_text(display.labelfont, "! CLEAR BONUS x"+str(self.level)+" !", 1, (255, 255, 255, 255))
+                    self.scoreticles.emit(((display.surface.get_width()>>1)-(score_img.get_width()>>1),score_img.get_height()>>1), 0, 0.6, score_img)
+            self.player.add_score(score)
+
+            if display.labelfont is not None:
+                score_img = display.render_number(display.labelfont, int(score), 1, (255, 255, 255, 255))
+                self.scoreticles.emit(centre_pos, 0, 0.3, score_img)
+
+            s.alive = False
+
+            for i in xrange(0, random.randint(*settings["particles"])):
+                if self.particles.count >= settings["particles_max"]:
+                    break
+                sprite = self.particle_sprites[i % len(self.particle_sprites)]
+                radius = sprite.get_width() >> 1
+                self.particles.emit(centre_pos, 0.3-random.random()*(0.6), 0.1-random.random()*0.2, sprite, (radius, radius))
+
+    def draw_targets(self):
+        display = self.display
+        for s in self.targets:
+            # Draw targeting object
+            if s.alive:
+                display.submit(s.icon, self.targets.slots[s][:2], RenderQueue.TARGETED)
+
+                if self.instructions_done == False: # Hint for the player
+                    s.draw_highlight(display, (136, 255, 242, display.rng.randint(30, 170)), RenderQueue.TARGETED)
+                    display.submit_draw(functools.partial(pygame.draw.line, display.surface, (136, 255, 242, display.rng.randint(30, 170)), (0,s.icon.get_height()+2), (display.surface.get_width()>>1,s.icon.get_height()+2)), RenderQueue.TARGETED)
+
+    def update_effects(self):
+        display = self.display
+        newFadeText = []
+        for f in self.fadeText:
+            text, counter = f
+            counter -= 1
+            if counter > 0:
+                newFadeText.append((text, counter))
+        self.fadeText = newFadeText
+
+        self.particles.update(display.surface.get_width(), display.surface.get_height())
+        self.scoreticles.update(display.surface.get_width(), display.surface.get_height())
+
+        if display.labelfont is not None and (self.iterationCount == 500 or ((self.iterationCount %800 == 0) and self.instructions_done == False)): # Repeat if no click
+            score_img = display.render_text(display.labelfont, "Left click select & move to match butterflies", -20, (136, 255, 242, random.randint(30,170)))
+            self.scoreticles.emit(((display.surface.get_width() >> 1) - (score_img.get_width() >> 1), 64), 0, 0.6, score_img)
+
+    def draw_fade_text(self):
+        display = self.display
+        if display.labelfontbig is None:
+            return # Still loading
+        for text, counter in self.fadeText:
+            text_img = display.text.render_faded(display.labelfontbig, text, 1, (255, 255, 255, 255), counter)
+            display.submit_faded(text_img, ((display.surface.get_width()>>1)-(text_img.get_width()>>1),(display.surface.get_height()>>1)-(text_img.get_height()>>1)), counter)
+
+    def draw_particles(self):
+        display = self.display
+        display.submit_many(self.particles.blit_list())
+        display.submit_many(self.scoreticles.blit_list())
+
+    def draw_hud(self):
+        display = self.display
+        # HUD
+
+        if display.labelfontbig is not None:
+            scorelabel_w = display.render_number(display.labelfontbig, int(self.player.score), 1, (255, 255, 255, 255))
+            scorelabel_b = display.render_number(display.labelfontbig, int(self.player.score), 1, (0, 0, 0, 128))
+            slw = scorelabel_w.get_width()
+            slh = scorelabel_w.get_height()
+            display.submit(scorelabel_b, ((display.surface.get_width()>>1)-(slw>>1), display.surface.get_height()-slh))
+            display.submit(scorelabel_w,
+                                 ((display.surface.get_width() >> 1) - (slw >> 1)-4, display.surface.get_height() - slh-4))
+
+        if self.logo is not None:
+            display.submit(self.logo, (display.surface.get_width()-self.logo.get_width(),0))
+
+    def draw_loading(self):
+        # A bar along the bottom while startup is still going on in the background
+        progress = self.loading_progress()
+        if progress >= 1.0:
+            self.loaded = time.time() - self.started
+            return
+        display = self.display
+        display.mark(pygame.draw.rect(display.surface, (136, 255, 242, 255), (0, display.height-4, int(display.width*progress), 4)))
+
+    def handle_events(self):
+        # Event loop
+        PROFILER.start("events")
+        events = self.display.get_events()
+        if self.script is not None:
+            events.extend(self.script.get(self.iterationCount, []))
+        if self.replay is not None:
+            for event in events:
+                self.replay.record(self.iterationCount, event)
+
+        for event in events:
+            if event.type == pygame.QUIT:
+                self.running = False
+            elif event.type == pygame.MOUSEMOTION:
+                self.mousepos = event.pos
+                if self.selected is not None:
+                    self.selected.position = self.mousepos
+                    # print selected.position
+            elif event.type == pygame.MOUSEBUTTONDOWN:
+                self.instructions_done = True
+                clicked = self.display.world.query_point(event.pos)
+                if len(clicked) > 0:
+                    self.selected = clicked[0] # Topmost
+                    self.selected.selected = True
+                    self.player.stats.select_success += 1
+
+            elif event.type == pygame.MOUSEBUTTONUP:
+                    if self.selected is not None:
+                        self.selected.selected = False
+                        self.selected = None
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                self.display.show_profiler = not self.display.show_profiler
+                PROFILER.enabled = self.display.show_profiler or PROFILER.recording
+            else:
+                pass
+                # print event # Placeholder
+        PROFILER.stop("events")
+
+
+def main_loop(headless=False, seed=None, frames=None, script=None, profile=None, dirty_rects=False, record=None, shards=0, population=None,
+              govern=True, swarm=False, seeds=None):
+    # Headless runs use dummy video and audio drivers and build butterflies on this thread, so a seed replays exactly.
+    # Give a .json or .csv filename as profile to save the profiler's histograms there on the way out.
+    # Give a filename as record to save a replay of the session there, which also builds butterflies on this thread.
+    # swarm simulates the butterflies a whole array at a time (numpy), and shards in that many worker processes,
+    # for populations far beyond the usual 30.
+    # seeds (first, last) spawns only butterflies from that range, e.g. the ones generate.py baked into the texture cache.
+    # govern scales the population and effects to hold the frame rate, in windowed sessions that aren't being recorded
+    if profile is not None:
+        PROFILER.enabled = PROFILER.recording = True
+    max_items = 30
+    if population is not None:
+        max_items = population
+    replay = None
+    if record is not None:
+        if seed is None:
+            seed = random.randint(0, MAX_SEED)
+        replay = Replay(seed, population, max_items, shards, swarm, seeds)
+    if seed is not None:
+        random.seed(seed) # So the shards' seeds come from it too
+    world = World("Butterflies", swarm=swarm, shards=shards) # Before the display, so the shard processes fork without pygame set up
+    display = Display(world, (800,800), (0,0), headless)
+    display.set_dirty_rects(dirty_rects)
+    workers = 2
+    if headless or record is not None:
+        workers = 0
+    game = Game(display, seed, workers, population, max_items, script=script, replay=replay,
+                govern=govern and not headless and record is None, seeds=seeds)
+
+    # Main loop
+    while game.running:
+        if frames is not None and game.iterationCount >= frames:
+            break
+        if headless:
+            game.step()
+        else:
+            game.run_frame()
+    if profile is not None:
+        PROFILER.export(profile)
+    if replay is not None:
+        replay.ticks = game.iterationCount
+        replay.save(record)
+    game.governor.restore()
+    world.close()
+    return False
+
+
+def play_replay(filename, render_ticks=(), snapshot="replay_%06d.png"):
+    # Simulate a recorded session again, headless and as fast as it goes. Only the ticks asked for are drawn,
+    # each saved as an image named by snapshot. Returns the game as it ended, e.g. to check the score
+    replay = Replay.load(filename)
+    random.seed(replay.seed) # As main_loop does, for the shards' seeds
+    world = World("Butterflies", swarm=replay.swarm, shards=replay.shards)
+    display = Display(world, (800,800), (0,0), headless=True)
+    game = Game(display, replay.seed, workers=0, population=replay.population, max_items=replay.max_items, script=replay.script(),
+                seeds=replay.seeds)
+    render_ticks = set(render_ticks)
+    while game.running and game.iterationCount < replay.ticks:
+        game.handle_events()
+        game.simulate()
+        if game.iterationCount in render_ticks:
+            game.render(1.0)
+            pygame.image.save(display.surface, snapshot % game.iterationCount)
+        PROFILER.end_frame()
+    world.close()
+    return game
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Hunt for the matching butterflies!")
+    parser.add_argument("--headless", action="store_true", help="run without a window or sound")
+    parser.add_argument("--seed", type=int, help="seed for a repeatable session")
+    parser.add_argument("--frames", type=int, help="stop after this many frames")
+    parser.add_argument("--profile", metavar="FILE", help="time each frame and save histograms to FILE (.json or .csv)")
+    parser.add_argument("--dirty-rects", action="store_true", help="only redraw the parts of the screen that change")
+    parser.add_argument("--quality", choices=list(QUALITY_LEVELS), default=TEXTURE_QUALITY, help="butterfly texture detail")
+    parser.add_argument("--record", metavar="FILE", help="save a replay of the session to FILE")
+    parser.add_argument("--replay", metavar="FILE", help="play back a replay headless, as fast as possible")
+    parser.add_argument("--render-ticks", metavar="TICKS", default="", help="with --replay, comma separated ticks to save as images")
+    parser.add_argument("--swarm", action="store_true", help="simulate the butterflies as arrays, for big populations (needs numpy)")
+    parser.add_argument("--shards", type=int, default=0, help="simulate the world in this many worker processes (needs numpy)")
+    parser.add_argument("--population", type=int, help="how many butterflies to keep in the world")
+    parser.add_argument("--texture-cache", metavar="FOLDER", help="keep rasterised butterflies in FOLDER, e.g. cache/textures")
+    parser.add_argument("--texture-cache-mb", metavar="MB", type=int, default=64, help="--texture-cache size, 0 for no limit (default 64)")
+    parser.add_argument("--fixed-quality", action="store_true", help="keep the population and effects as set, however slow the frames")
+    parser.add_argument("--seeds", type=int, nargs=2, metavar=("FIRST", "LAST"),
+                        help="only spawn butterflies with seeds FIRST up to LAST, e.g. the ones generate.py put in --texture-cache")
+    args = parser.parse_args()
+    TEXTURE_QUALITY = args.quality
+    if args.texture_cache is not None:
+        TEXTURE_CACHE = TextureCache(args.texture_cache, (args.texture_cache_mb<<20) or None)
+    if args.replay is not None:
+        game = play_replay(args.replay, [int(tick) for tick in args.render_ticks.split(",") if tick])
+        print("Replayed %d ticks, score %d" % (game.iterationCount, game.player.score))
+    else:
+        main_loop(args.headless, args.seed, args.frames, profile=args.profile, dirty_rects=args.dirty_rects, record=args.record,
+                  shards=args.shards, population=args.population, govern=not args.fixed_quality,
+                  swarm=args.swarm, seeds=None if args.seeds is None else tuple(args.seeds))